@@ -0,0 +1,55 @@
+# Callback dispatch latency through handle_button with Telegram calls stubbed.
+#
+#   python benchmarks/bench_dispatch.py
+#
+# Every query.answer()/edit_message_text() is a no-op, so the numbers are the
+# bot's own routing, auth and state-loading overhead per callback.
+import asyncio, contextlib, io, os, sys, tempfile, time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.chdir(tempfile.mkdtemp())
+os.environ["ADMIN_IDS"] = "1"
+os.environ.setdefault("STATE_MAX_STALENESS", "3600")
+# Every round repeats the same press; measure handling, not the debounce.
+os.environ.setdefault("CALLBACK_DEBOUNCE_SECONDS", "0")
+
+import giveaway_bot as gb
+
+ROUNDS = 5000
+CALLBACKS = [
+    "noop", "user:help", "user:enter", "admin:cancel_end",
+    "admin:manage_buttons", "admin:show_winners", "admin:edit_button:0",
+]
+
+async def _noop(*args, **kwargs):
+    return None
+
+def _update(data: str):
+    user = SimpleNamespace(id=1, username="admin", first_name="A", last_name="")
+    query = SimpleNamespace(data=data, from_user=user, answer=_noop, edit_message_text=_noop)
+    chat = SimpleNamespace(id=1, type="private")
+    message = SimpleNamespace(reply_text=_noop)
+    return SimpleNamespace(callback_query=query, effective_user=user, effective_chat=chat, message=message)
+
+async def main() -> None:
+    s = gb._load()
+    gb._commit(s, {"op": "start"})
+    gb._enter(s, SimpleNamespace(id=1, username="admin", first_name="A", last_name=""))
+    gb._save_custom_buttons([{"name": "Site", "url": "https://example.com", "side_by_side": False}])
+    context = SimpleNamespace(bot=None, user_data={}, args=[])
+    print(f"{'callback':<24} {'µs/callback':>12}")
+    for data in CALLBACKS:
+        update = _update(data)
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            for _ in range(ROUNDS):
+                await gb.handle_button(update, context)
+            elapsed = time.perf_counter() - t0
+        print(f"{data:<24} {elapsed / ROUNDS * 1e6:12.2f}")
+    gb._pending_ops.clear()
+    if gb._flush_task is not None:
+        gb._flush_task.cancel()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+# Draws that only pick group members, on a big pool where a third of the
+# entrants have left the group. getChatMember is faked with a fixed round trip.
+#
+#   python benchmarks/bench_eligibility.py [entries] [api latency ms]
+#
+# "cold" starts with nothing known about anyone, so every drawn winner is
+# checked at draw time; "warm" first feeds the cache from chat_member updates
+# the way the bot would see joins and leaves. Checks run at the default
+# ELIGIBILITY_RATE. While each draw runs, another user keeps clicking the entry
+# button; "entry wait" is the slowest of those clicks, which shows how long the
+# draw held the entry lock. Every draw must replay from the audit log. Runs in
+# a scratch directory.
+import asyncio, itertools, json, os, sys, tempfile, time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.chdir(tempfile.mkdtemp())
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1:eligibility")
+
+from telegram.constants import ChatMemberStatus
+import giveaway_bot as gb
+
+ENTRANTS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+API_LATENCY = (float(sys.argv[2]) if len(sys.argv) > 2 else 10) / 1000
+GROUP = -100
+LATE = itertools.count(10**9)
+
+def is_member(uid: int) -> bool:
+    return uid % 3 != 0
+
+class FakeBot:
+    def __init__(self):
+        self.calls = 0
+
+    async def get_chat_member(self, chat_id, user_id):
+        self.calls += 1
+        await asyncio.sleep(API_LATENCY)
+        return SimpleNamespace(status=ChatMemberStatus.MEMBER if is_member(user_id) else ChatMemberStatus.LEFT)
+
+async def keep_entering(stop: asyncio.Event, waits: list) -> None:
+    while True:
+        t0 = time.perf_counter()
+        await gb.ENTRY_BATCHER.submit(SimpleNamespace(id=next(LATE), username="", first_name="Late", last_name=""), GROUP)
+        waits.append(time.perf_counter() - t0)
+        if stop.is_set():
+            return
+        await asyncio.sleep(0.01)
+
+async def run(name: str, warm: bool) -> bool:
+    gb._STATES.clear()
+    gb.ELIGIBILITY = gb.Eligibility(gb.ELIGIBILITY_CACHE_TTL, max(gb.ELIGIBILITY_CACHE_SIZE, ENTRANTS))
+    s = gb._load(GROUP)
+    gb._commit(s, {"op": "start"})
+    gb._commit_seed(s)
+    for uid in range(1, ENTRANTS + 1):
+        gb._enter(s, SimpleNamespace(id=uid, username=f"user{uid}", first_name="First", last_name="Last"))
+    gb._flush()
+    if warm:
+        for uid in range(1, ENTRANTS + 1):
+            gb.ELIGIBILITY.record(GROUP, uid, is_member(uid))
+    bot = FakeBot()
+    ok = True
+    for k in (1, 10, 100):
+        stop, waits = asyncio.Event(), []
+        entering = asyncio.create_task(keep_entering(stop, waits))
+        await asyncio.sleep(0)
+        t0 = time.perf_counter()
+        op = await gb._draw_eligible(bot, s, k)
+        elapsed = time.perf_counter() - t0
+        stop.set()
+        await entering
+        ok = ok and all(is_member(w[0]) for w in op["winners"])
+        print(f"{name:<5}  {k:>4}  {elapsed * 1e3:9.1f}  {bot.calls:>6}  {len(op['excluded']):>11}  {max(waits) * 1e3:13.1f}")
+        bot.calls = 0
+    gb._flush()
+    with open(gb.DRAW_AUDIT_FILE, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    checked, problems = gb.verify_draws(s, records)
+    if problems or not ok:
+        print(f"       FAILED: {problems[:3] or 'a non-member won'}")
+    os.remove(gb.DRAW_AUDIT_FILE)
+    return ok and not problems
+
+async def main() -> None:
+    print(f"{ENTRANTS:,} entries, a third not in the group, {API_LATENCY * 1e3:g} ms per getChatMember")
+    print(f"{'cache':<5}  {'k':>4}  {'draw ms':>9}  {'checks':>6}  {'passed over':>11}  {'entry wait ms':>13}")
+    ok = all([await run("cold", False), await run("warm", True)])
+    raise SystemExit(0 if ok else 1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
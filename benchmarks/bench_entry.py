@@ -0,0 +1,83 @@
+# Per-click entry latency against pools of 1k to 1M entrants, the cost of a
+# Pick Random (a committed draw of one, persisted and audited), and tail
+# latency of a burst of concurrent clicks with and without group commit.
+#
+#   python benchmarks/bench_entry.py
+#
+# Runs in a scratch directory; nothing is written next to the bot's own state.
+import asyncio, os, sys, tempfile, time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.chdir(tempfile.mkdtemp())
+os.environ.setdefault("STATE_MAX_STALENESS", "3600")
+
+import giveaway_bot as gb
+
+CLICKS = 2000
+# A draw digests the whole pool, so fewer of them.
+PICKS = 20
+
+def _user(uid: int):
+    return SimpleNamespace(id=uid, username=f"user{uid}", first_name="First", last_name="Last")
+
+async def run(pool: int) -> None:
+    s = gb._blank_state()
+    s["active"] = True
+    s["entries"] = gb.EntryStore({"user_id": uid, "username": f"user{uid}", "first_name": "First", "last_name": "Last"} for uid in range(pool))
+    gb._STATES[gb.DEFAULT_GIVEAWAY] = s
+
+    t0 = time.perf_counter()
+    for uid in range(pool, pool + CLICKS):
+        gb._enter(s, _user(uid))
+    new = (time.perf_counter() - t0) / CLICKS
+
+    t0 = time.perf_counter()
+    for uid in range(0, pool, max(1, pool // CLICKS))[:CLICKS]:
+        gb._enter(s, _user(uid))
+    dup = (time.perf_counter() - t0) / CLICKS
+
+    gb._pending_ops.clear()
+    t0 = time.perf_counter()
+    for _ in range(PICKS):
+        gb._commit_draw(s, 1)
+    pick = (time.perf_counter() - t0) / PICKS
+
+    print(f"{pool:>9,}  {new * 1e6:10.2f}  {dup * 1e6:10.2f}  {pick * 1e6:10.2f}")
+
+STORM = 2000
+
+async def storm(batch_max: int) -> None:
+    # STORM users click at once; each latency runs until the entry is on disk.
+    gb._STATES.clear()
+    gb.STORAGE = gb.JsonStorage()
+    s = gb._load()
+    gb._commit(s, {"op": "start"})
+    gb._flush()
+    gb.ENTRY_BATCH_MAX = batch_max
+    latencies = []
+    async def click(uid):
+        t0 = time.perf_counter()
+        await gb.ENTRY_BATCHER.submit(_user(uid))
+        latencies.append(time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(click(uid) for uid in range(STORM)))
+    total = time.perf_counter() - t0
+    latencies.sort()
+    p50, p99 = latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+    print(f"{batch_max:>9}  {p50 * 1e3:10.2f}  {p99 * 1e3:10.2f}  {total:8.2f}")
+
+async def main() -> None:
+    print(f"{'entries':>9}  {'enter µs':>10}  {'dup µs':>10}  {'pick µs':>10}")
+    for pool in (1_000, 10_000, 100_000, 1_000_000):
+        await run(pool)
+    print()
+    print(f"{STORM} concurrent clicks, latency until persisted")
+    print(f"{'batch max':>9}  {'p50 ms':>10}  {'p99 ms':>10}  {'total s':>8}")
+    for batch_max in (1, gb.ENTRY_BATCH_MAX):
+        await storm(batch_max)
+    if gb._flush_task is not None:
+        gb._flush_task.cancel()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,163 @@
+# Load test of the whole bot: the real Application and handlers, fed synthetic
+# updates, talking to an in-process fake Bot API with a fixed round trip.
+#
+#   python benchmarks/bench_load.py [entrants] [api latency ms]
+#
+# Scenarios:
+#   start     every entrant sends /start
+#   enter     every entrant clicks the entry button
+#   mixed     a second wave of entrants while admins page through entries and draw
+#   mash      a third wave of entrants, each pressing the entry button 5 times
+#   entries   an admin pages through the whole pool
+#   chatter   plain messages from group members, which the bot ignores
+#   fanout    one announcement round to every linked group
+#
+# Updates are processed UPDATE_CONCURRENCY at a time, like the webhook mode.
+# Latency is per update, from dispatch until every handler call returned.
+# Memory is the peak RSS of the process so far. Runs in a scratch directory.
+import asyncio, itertools, json, os, resource, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.chdir(tempfile.mkdtemp())
+os.environ["ADMIN_IDS"] = "1"
+os.environ["TELEGRAM_BOT_TOKEN"] = "1:load"
+# Measure the bot's own fan-out cost, not Telegram's rate limits.
+os.environ.setdefault("BROADCAST_GLOBAL_RATE", "1000000")
+os.environ.setdefault("BROADCAST_CHAT_RATE", "1000000")
+
+from telegram import Update
+from telegram.request import BaseRequest
+import giveaway_bot as gb
+
+ENTRANTS = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+API_LATENCY = (float(sys.argv[2]) if len(sys.argv) > 2 else 10) / 1000
+GROUPS = 200
+ADMIN = 1
+
+class FakeBotApi(BaseRequest):
+    # Answers every Bot API call in process after API_LATENCY, with just
+    # enough of a result for PTB to parse.
+    def __init__(self):
+        self.calls = 0
+        self._message_id = itertools.count(1)
+
+    @property
+    def read_timeout(self):
+        return 5
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        self.calls += 1
+        api = url.rsplit("/", 1)[-1]
+        params = request_data.json_parameters if request_data else {}
+        await asyncio.sleep(API_LATENCY)
+        result = True
+        if api == "getMe":
+            result = {"id": 10, "is_bot": True, "first_name": "Load", "username": "load_bot"}
+        elif api in ("sendMessage", "editMessageText", "sendDocument"):
+            chat_id = int(params.get("chat_id") or 0)
+            result = {"message_id": next(self._message_id), "date": 0, "text": params.get("text", ""),
+                      "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"}}
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+_ids = itertools.count(1)
+
+def _user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": f"U{uid}", "username": f"user{uid}"}
+
+def command(bot, uid: int, text: str) -> Update:
+    n = next(_ids)
+    return Update.de_json({"update_id": n, "message": {
+        "message_id": n, "date": 0, "chat": {"id": uid, "type": "private"}, "from": _user(uid), "text": text,
+        "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+    }}, bot)
+
+def text(bot, uid: int, chat_id: int, body: str) -> Update:
+    n = next(_ids)
+    return Update.de_json({"update_id": n, "message": {
+        "message_id": n, "date": 0, "chat": {"id": chat_id, "type": "supergroup"}, "from": _user(uid), "text": body,
+    }}, bot)
+
+def click(bot, uid: int, data: str) -> Update:
+    n = next(_ids)
+    return Update.de_json({"update_id": n, "callback_query": {
+        "id": str(n), "from": _user(uid), "chat_instance": "1", "data": data,
+        "message": {"message_id": n, "date": 0, "chat": {"id": uid, "type": "private"}, "text": "menu"},
+    }}, bot)
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+async def scenario(name: str, app, api: FakeBotApi, updates) -> None:
+    limit = asyncio.Semaphore(gb.UPDATE_CONCURRENCY)
+    latencies = []
+    async def one(update):
+        async with limit:
+            t0 = time.perf_counter()
+            await app.process_update(update)
+            latencies.append(time.perf_counter() - t0)
+    calls = api.calls
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(u) for u in updates))
+    report(name, len(updates), time.perf_counter() - t0, latencies, api.calls - calls)
+
+def report(name: str, count: int, elapsed: float, latencies, calls: int) -> None:
+    latencies.sort()
+    p50 = f"{latencies[len(latencies) // 2] * 1e3:.1f}" if latencies else "-"
+    p99 = f"{latencies[int(len(latencies) * 0.99)] * 1e3:.1f}" if latencies else "-"
+    print(f"{name:<8}  {count:>7}  {count / elapsed:9.0f}  {p50:>8}  {p99:>8}  {calls:>7}  {_peak_rss_mb():7.0f}")
+
+async def main() -> None:
+    api = FakeBotApi()
+    app = gb.build_application(api)
+    await app.initialize()
+    await app.post_init(app)
+    bot = app.bot
+    await app.process_update(click(bot, ADMIN, "admin:start"))
+
+    print(f"{ENTRANTS} entrants, {GROUPS} groups, {API_LATENCY * 1e3:g} ms per API call, {gb.UPDATE_CONCURRENCY} updates at a time")
+    print(f"{'scenario':<8}  {'updates':>7}  {'updates/s':>9}  {'p50 ms':>8}  {'p99 ms':>8}  {'calls':>7}  {'RSS MB':>7}")
+    entrants = range(100, 100 + ENTRANTS)
+    await scenario("start", app, api, [command(bot, uid, "/start") for uid in entrants])
+    await scenario("enter", app, api, [click(bot, uid, "user:enter:0") for uid in entrants])
+
+    # Admin actions land between the entry clicks.
+    wave = range(100 + ENTRANTS, 100 + 2 * ENTRANTS)
+    updates = []
+    for i, uid in enumerate(wave):
+        updates.append(click(bot, uid, "user:enter:0"))
+        if i % 100 == 0:
+            updates.append(click(bot, ADMIN, f"admin:entries_page:{i // 100}"))
+        if i % 1000 == 0:
+            updates.append(click(bot, ADMIN, "admin:draw:5"))
+    await scenario("mixed", app, api, updates)
+
+    mash = range(100 + 2 * ENTRANTS, 100 + 3 * ENTRANTS)
+    await scenario("mash", app, api, [click(bot, uid, "user:enter:0") for uid in mash for _ in range(5)])
+
+    pages = gb._load()["entries"].page_count(gb.ENTRIES_PAGE_SIZE)
+    await scenario("entries", app, api, [click(bot, ADMIN, f"admin:entries_page:{p}") for p in range(pages)])
+
+    await scenario("chatter", app, api, [text(bot, uid, -1000, "hello everyone") for uid in entrants])
+
+    # Each group gets its own admin and giveaway; one round reaches them all.
+    for g in range(GROUPS):
+        gb._save_admin_group(1000000 + g, -1000 - g)
+        await app.process_update(click(bot, 1000000 + g, "admin:start"))
+    calls = api.calls
+    t0 = time.perf_counter()
+    await gb.ANNOUNCER._announce([-1000 - g for g in range(GROUPS)])
+    # Fan-out is one call, so only its throughput is reported.
+    report("fanout", GROUPS, time.perf_counter() - t0, [], api.calls - calls)
+
+    await app.post_stop(app)
+    await app.shutdown()
+    await app.post_shutdown(app)
+
+if __name__ == "__main__":
+    asyncio.run(main())
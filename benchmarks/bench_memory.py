@@ -0,0 +1,66 @@
+# Memory and load time of a big pool: the columnar EntryStore against the
+# list of entry dicts (plus user_id index) the store used to hold.
+#
+#   python benchmarks/bench_memory.py [entries ...]
+#
+# Each case loads a snapshot in a fresh process, so RSS is not shared between
+# cases. "dicts" loads a snapshot in the old list-of-entries format, "columns"
+# one in the current columnar format through JsonStorage. Runs in a scratch
+# directory.
+import json, os, subprocess, sys, tempfile, time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+FIRST_NAMES = [f"First{i}" for i in range(2000)]
+LAST_NAMES = [f"Last{i}" for i in range(3000)]
+
+def _entries(n: int):
+    return ({"user_id": 10**9 + uid * 7, "username": f"user{uid}", "first_name": FIRST_NAMES[uid % 2000],
+             "last_name": LAST_NAMES[uid % 3000], "number": uid + 1} for uid in range(n))
+
+def write_snapshots(n: int) -> None:
+    sys.path.insert(0, ROOT)
+    import giveaway_bot as gb
+    state = gb._blank_state()
+    state["entries"] = gb.EntryStore(_entries(n))
+    gb.STORAGE.write_snapshot(gb.DEFAULT_GIVEAWAY, state)
+    os.replace(gb.STATE_FILE, "columns.json")
+    with open("dicts.json", "w", encoding="utf-8") as f:
+        json.dump(dict(gb._blank_state(), entries=list(_entries(n)), next_number=n + 1), f, separators=(",", ":"))
+
+def _status_mb(field: str) -> float:
+    # VmHWM starts afresh on exec, unlike ru_maxrss, which a child inherits.
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith(field + ":")) / 1024
+
+def load(case: str) -> None:
+    sys.path.insert(0, ROOT)
+    import giveaway_bot as gb
+    base = _status_mb("VmRSS")
+    t0 = time.perf_counter()
+    if case == "dicts":
+        with open("dicts.json", encoding="utf-8") as f:
+            entries = json.load(f)["entries"]
+        index = {e["user_id"]: i for i, e in enumerate(entries)}
+    else:
+        os.replace("columns.json", gb.STATE_FILE)
+        store = gb.STORAGE.load_state()["entries"]
+    elapsed = time.perf_counter() - t0
+    print(json.dumps({"load_s": elapsed, "rss_mb": _status_mb("VmRSS") - base, "peak_mb": _status_mb("VmHWM")}))
+
+def main() -> None:
+    sizes = [int(a) for a in sys.argv[1:]] or [100000, 1000000]
+    print(f"{'entries':>9}  {'format':<7}  {'file MB':>7}  {'load s':>6}  {'held MB':>7}  {'peak RSS MB':>11}")
+    for n in sizes:
+        os.chdir(tempfile.mkdtemp())
+        write_snapshots(n)
+        for case in ("dicts", "columns"):
+            size = os.path.getsize(f"{case}.json") / 2**20
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), "--load", case], capture_output=True, text=True, check=True)
+            r = json.loads(out.stdout)
+            print(f"{n:>9,}  {case:<7}  {size:7.1f}  {r['load_s']:6.2f}  {r['rss_mb']:7.0f}  {r['peak_mb']:11.0f}")
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--load"]:
+        load(sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,108 @@
+# Several worker processes on one shared-state database (STORAGE_BACKEND=shared).
+# Every worker clicks "enter" for every user at once, then every worker runs
+# draws at once. Afterwards the database must hold each user exactly once,
+# with unique numbers, no winner drawn twice, and every draw must replay
+# from the audit log.
+#
+#   python benchmarks/bench_shared.py
+#
+# Runs in a scratch directory; nothing is written next to the bot's own state.
+import asyncio, json, multiprocessing, os, sys, tempfile, time
+from types import SimpleNamespace
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+USERS = 5000
+DRAWS = 10
+DRAW_K = 5
+
+def _user(uid: int):
+    return SimpleNamespace(id=uid, username=f"user{uid}", first_name="First", last_name="Last")
+
+def worker(worker_id: int, barrier, results) -> None:
+    sys.path.insert(0, ROOT)
+    import giveaway_bot as gb
+
+    async def run():
+        barrier.wait()
+        t0 = time.perf_counter()
+        # Each worker walks the users from a different starting point.
+        shift = worker_id * USERS // 4
+        uids = list(range(shift, USERS)) + list(range(shift))
+        entered = await asyncio.gather(*(gb.ENTRY_BATCHER.submit(_user(uid)) for uid in uids))
+        enter_s = time.perf_counter() - t0
+        # Drawn users leave the pool and could enter again, so nobody draws
+        # until every worker is done entering.
+        barrier.wait()
+        drawn = []
+        for _ in range(DRAWS):
+            s = gb._load()
+            async with gb.ENTRIES_LOCK, gb.WINNERS_LOCK:
+                op = gb._commit_draw(s, DRAW_K)
+            if op:
+                drawn.extend(w[0] for w in op["winners"])
+        new = [(uid, number) for uid, (number, created) in zip(uids, entered) if created]
+        results.put((new, drawn, enter_s))
+
+    asyncio.run(run())
+
+def check(gb, outcomes) -> list:
+    problems = []
+    new = [n for o in outcomes for n in o[0]]
+    drawn = [uid for o in outcomes for uid in o[1]]
+    if sorted(uid for uid, _ in new) != list(range(USERS)):
+        problems.append(f"{len(new)} users reported as newly entered, expected {USERS} distinct")
+    if sorted(number for _, number in new) != list(range(1, USERS + 1)):
+        problems.append("entry numbers are not 1..USERS without gaps or repeats")
+    if len(set(drawn)) != len(drawn):
+        problems.append("a user was drawn more than once")
+    gb._STATES.clear()
+    s = gb._load()
+    in_pool = {e["user_id"] for e in s["entries"]}
+    winners = [e["user_id"] for e in s["winners"]]
+    if sorted(winners) != sorted(drawn):
+        problems.append("stored winners differ from the winners the workers announced")
+    if in_pool & set(winners) or len(in_pool) + len(winners) != USERS:
+        problems.append("pool and winners don't partition the users")
+    with open(gb.DRAW_AUDIT_FILE, encoding="utf-8") as f:
+        checked, bad = gb.verify_draws(s, [json.loads(line) for line in f])
+    if checked != len(s["draws"]) or bad:
+        problems.append(f"audit replay: {checked} of {len(s['draws'])} draws checked, {bad[:3]}")
+    return problems
+
+def run(workers: int) -> bool:
+    os.chdir(tempfile.mkdtemp())
+    os.environ["STORAGE_BACKEND"] = "shared"
+    sys.path.insert(0, ROOT)
+    import giveaway_bot as gb
+    gb.STORAGE = gb.SharedSqliteStorage(gb.SQLITE_FILE)
+    gb._STATES.clear()
+    s = gb._load()
+    with gb._transaction(s):
+        gb._commit(s, {"op": "start"})
+        gb._commit_seed(s)
+
+    ctx = multiprocessing.get_context("spawn")
+    barrier, results = ctx.Barrier(workers), ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(i, barrier, results)) for i in range(workers)]
+    for p in procs:
+        p.start()
+    outcomes = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    problems = check(gb, outcomes)
+    clicks = USERS * workers
+    enter_s = max(o[2] for o in outcomes)
+    print(f"{workers:>7}  {clicks:>7}  {clicks / enter_s:10.0f}  {'ok' if not problems else 'FAILED'}")
+    for p in problems:
+        print(f"         {p}")
+    gb.STORAGE.close()
+    return not problems
+
+def main() -> None:
+    print(f"{USERS} users, every worker clicks for every user, then {DRAWS} draws of {DRAW_K} per worker")
+    print(f"{'workers':>7}  {'clicks':>7}  {'clicks/s':>10}  check")
+    ok = all([run(workers) for workers in (1, 2, 4)])
+    raise SystemExit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
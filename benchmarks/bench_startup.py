@@ -0,0 +1,89 @@
+# Restart during a live giveaway: how long the bot takes from process start
+# until it is ready for updates, and how long the first updates then take.
+#
+#   python benchmarks/bench_startup.py [entries]
+#
+# A snapshot with that many entries is written to a scratch directory, then a
+# fresh process starts the bot against an in-process fake Bot API (no
+# latency), runs post_init and handles a /start and an entry click. Prints the
+# bot's own startup breakdown.
+import asyncio, json, os, subprocess, sys, tempfile, time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def write_snapshot(n: int) -> None:
+    sys.path.insert(0, ROOT)
+    import giveaway_bot as gb
+    state = gb._load()
+    state["active"] = True
+    state["entries"] = gb.EntryStore({"user_id": 10**9 + uid, "username": f"user{uid}", "first_name": f"First{uid % 2000}",
+                                      "last_name": f"Last{uid % 3000}"} for uid in range(n))
+    gb.STORAGE.write_snapshot(gb.DEFAULT_GIVEAWAY, state)
+
+async def restart() -> dict:
+    sys.path.insert(0, ROOT)
+    # First, so the bot's own clock covers the telegram imports.
+    import giveaway_bot as gb
+    from telegram import Update
+    from telegram.request import BaseRequest
+
+    class FakeBotApi(BaseRequest):
+        @property
+        def read_timeout(self):
+            return 5
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        async def do_request(self, url, method, request_data=None, **kwargs):
+            api = url.rsplit("/", 1)[-1]
+            params = request_data.json_parameters if request_data else {}
+            result = True
+            if api == "getMe":
+                result = {"id": 10, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+            elif api in ("sendMessage", "editMessageText"):
+                result = {"message_id": 1, "date": 0, "text": params.get("text", ""), "chat": {"id": 7, "type": "private"}}
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    app = gb.build_application(FakeBotApi())
+    await app.initialize()
+    await app.post_init(app)
+    ready = time.perf_counter() - gb._STARTED
+    user = {"id": 7, "is_bot": False, "first_name": "New"}
+    chat = {"id": 7, "type": "private"}
+    first = {}
+    for name, update in [
+        ("/start", {"update_id": 1, "message": {"message_id": 1, "date": 0, "chat": chat, "from": user, "text": "/start",
+                                                "entities": [{"type": "bot_command", "offset": 0, "length": 6}]}}),
+        ("enter", {"update_id": 2, "callback_query": {"id": "2", "from": user, "chat_instance": "1", "data": "user:enter:0",
+                                                      "message": {"message_id": 1, "date": 0, "chat": chat, "text": "menu"}}}),
+    ]:
+        t0 = time.perf_counter()
+        await app.process_update(Update.de_json(update, app.bot))
+        first[name] = time.perf_counter() - t0
+    await app.shutdown()
+    return {"ready": ready, "first": first, "phases": gb.STARTUP_PHASES}
+
+def main() -> None:
+    entrants = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    os.chdir(tempfile.mkdtemp())
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1:startup")
+    os.environ.setdefault("RUN_ANNOUNCER", "0")
+    write_snapshot(entrants)
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--restart"], stdout=subprocess.PIPE, text=True, check=True)
+    r = json.loads(out.stdout)
+    print(f"{entrants:,} entries in the snapshot")
+    print(f"ready for updates after {r['ready'] * 1e3:.0f} ms:")
+    for name, seconds in r["phases"]:
+        print(f"  {name:<12} {seconds * 1e3:8.1f} ms")
+    for name, seconds in r["first"].items():
+        print(f"first {name:<7} {seconds * 1e3:8.1f} ms")
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--restart"]:
+        print(json.dumps(asyncio.run(restart())))
+    else:
+        main()
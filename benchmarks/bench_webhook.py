@@ -0,0 +1,122 @@
+# Webhook mode end to end: the bot runs as a subprocess with RUN_MODE=webhook
+# against a fake Telegram server, which posts synthetic updates to the bot's
+# webhook the way Telegram does and counts the bot's API calls.
+#
+#   python benchmarks/bench_webhook.py
+#
+# Needs aiohttp. Each run gets a scratch directory for the bot's state.
+import asyncio, os, socket, subprocess, sys, tempfile, time
+from aiohttp import ClientSession, web
+
+BOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "giveaway_bot.py")
+TOKEN = "1:bench"
+ADMIN = 1
+USERS = 2000
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class FakeTelegram:
+    # Just enough of the Bot API for the bot to start, reply and answer
+    # callbacks. Requests arrive form-encoded, like PTB sends them. Every
+    # handled click ends with an editMessageText.
+    def __init__(self):
+        self.calls: dict = {}
+        self.webhook = None
+        self.webhook_set = asyncio.Event()
+        self.edited = 0
+        self.all_edited = asyncio.Event()
+        self.expected = 0
+        self.message_id = 0
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] = self.calls.get(method, 0) + 1
+        result = True
+        if method == "getMe":
+            result = {"id": 10, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif method == "setWebhook":
+            self.webhook = params
+            self.webhook_set.set()
+        elif method in ("sendMessage", "editMessageText"):
+            if method == "editMessageText":
+                self.edited += 1
+                if self.edited >= self.expected:
+                    self.all_edited.set()
+            self.message_id += 1
+            result = {
+                "message_id": self.message_id, "date": int(time.time()), "text": params.get("text", ""),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+            }
+        return web.json_response({"ok": True, "result": result})
+
+_update_id = 0
+
+def _user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": f"U{uid}"}
+
+def callback_update(uid: int, data: str) -> dict:
+    global _update_id
+    _update_id += 1
+    message = {"message_id": 1, "date": 0, "chat": {"id": uid, "type": "private"}, "text": "menu"}
+    return {"update_id": _update_id, "callback_query": {
+        "id": str(_update_id), "from": _user(uid), "chat_instance": "1", "data": data, "message": message,
+    }}
+
+async def run(concurrency: int) -> None:
+    fake = FakeTelegram()
+    server = web.Application()
+    server.router.add_post("/bot{token}/{method}", fake.handle)
+    runner = web.AppRunner(server, access_log=None)
+    await runner.setup()
+    api_port, hook_port = _free_port(), _free_port()
+    await web.TCPSite(runner, "127.0.0.1", api_port).start()
+
+    env = dict(
+        os.environ, TELEGRAM_BOT_TOKEN=TOKEN, ADMIN_IDS=str(ADMIN), RUN_MODE="webhook",
+        BOT_API_URL=f"http://127.0.0.1:{api_port}/bot", WEBHOOK_URL=f"http://127.0.0.1:{hook_port}/hook",
+        WEBHOOK_LISTEN="127.0.0.1", WEBHOOK_PORT=str(hook_port), UPDATE_CONCURRENCY=str(concurrency), LOG_LEVEL="WARNING",
+    )
+    bot = subprocess.Popen([sys.executable, BOT], cwd=tempfile.mkdtemp(), env=env, stdout=subprocess.DEVNULL)
+    try:
+        await asyncio.wait_for(fake.webhook_set.wait(), 30)
+        url, secret = fake.webhook["url"], fake.webhook["secret_token"]
+        async with ClientSession() as http:
+            async def post(update, token=secret):
+                async with http.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": token}) as r:
+                    return r.status
+
+            assert await post(callback_update(ADMIN, "noop"), token="wrong") == 403
+
+            fake.expected = 1
+            await post(callback_update(ADMIN, "admin:start"))
+            await asyncio.wait_for(fake.all_edited.wait(), 30)
+
+            # Telegram keeps at most WEBHOOK_MAX_CONNECTIONS requests open.
+            fake.edited, fake.expected = 0, USERS
+            fake.all_edited.clear()
+            connections = asyncio.Semaphore(40)
+            async def click(uid):
+                async with connections:
+                    assert await post(callback_update(uid, "user:enter:0")) == 200
+            t0 = time.perf_counter()
+            await asyncio.gather(*(click(uid) for uid in range(100, 100 + USERS)))
+            await asyncio.wait_for(fake.all_edited.wait(), 120)
+            elapsed = time.perf_counter() - t0
+        print(f"{concurrency:>11}  {USERS / elapsed:10.0f}  {elapsed:9.2f}")
+    finally:
+        bot.terminate()
+        await asyncio.to_thread(bot.wait, 10)
+        await runner.cleanup()
+
+async def main() -> None:
+    print(f"{USERS} entry clicks posted to the webhook over 40 connections")
+    print(f"{'concurrency':>11}  {'updates/s':>10}  {'total s':>9}")
+    for concurrency in (1, 32):
+        await run(concurrency)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,26 +1,39 @@
 CUSTOM_BUTTONS_FILE = "custom_buttons.json"
 
+_custom_buttons_cache = None
+
 def _load_custom_buttons() -> list:
-    if not os.path.exists(CUSTOM_BUTTONS_FILE):
-        return []
-    try:
-        with open(CUSTOM_BUTTONS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except:
-        return []
+    global _custom_buttons_cache
+    if _custom_buttons_cache is not None and not _config_changed("custom_buttons"):
+        return _custom_buttons_cache
+    if _custom_buttons_cache is not None:
+        # Edited on another worker.
+        _invalidate_button_keyboards()
+    _custom_buttons_cache = STORAGE.load_custom_buttons()
+    return _custom_buttons_cache
 
 def _save_custom_buttons(buttons: list) -> None:
-    with open(CUSTOM_BUTTONS_FILE, "w", encoding="utf-8") as f:
-        json.dump(buttons, f, ensure_ascii=False, indent=2)
+    global _custom_buttons_cache
+    _custom_buttons_cache = buttons
+    STORAGE.save_custom_buttons(buttons)
+    _invalidate_button_keyboards()
 # Move async def set_announce_interval below imports
 # giveaway_bot.py
-import asyncio, json, os, random
+import time
+# The startup breakdown counts from here.
+_STARTED = time.perf_counter()
+import asyncio, base64, bisect, functools, gc, hashlib, heapq, hmac, io, itertools, json, logging, os, random, secrets, sys, tempfile
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from dotenv import load_dotenv
-from typing import Dict, Any, List
+from urllib.parse import urlsplit
+from typing import Callable, Dict, Any, List, Optional, Set, Tuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler, MessageHandler,
-    ConversationHandler, filters, ContextTypes
+    ConversationHandler, ChatMemberHandler, filters, ContextTypes
 )
 
 async def set_announce_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -33,24 +46,47 @@ async def set_announce_settings(update: Update, context: ContextTypes.DEFAULT_TY
     if minutes < 1:
         return await update.message.reply_text("Interval must be at least 1 minute.")
     message = " ".join(args[1:]).strip()
-    _save_announce_settings(minutes, message)
+    _save_announce_settings(minutes, message, _announce_group_for(update))
     await update.message.reply_text(f"Announcement interval set to {minutes} minutes.\nMessage set to: {message}")
 ADMIN_GROUPS_FILE = "admin_groups.json"
 
+_admin_groups_cache = None
+# The group ids in _admin_groups_cache, for lookups by chat id.
+_linked_groups_cache: Set[int] = set()
+
 def _load_admin_groups() -> dict:
-    if not os.path.exists(ADMIN_GROUPS_FILE):
-        return {}
-    try:
-        with open(ADMIN_GROUPS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except:
-        return {}
+    global _admin_groups_cache, _linked_groups_cache
+    # Other workers link admins too, so shared state rereads the table
+    # whenever its epoch has moved.
+    if _admin_groups_cache is not None and not _config_changed("admin_groups"):
+        return _admin_groups_cache
+    _admin_groups_cache = STORAGE.load_admin_groups()
+    _linked_groups_cache = set(_admin_groups_cache.values())
+    return _admin_groups_cache
+
+def _linked_groups() -> Set[int]:
+    _load_admin_groups()
+    return _linked_groups_cache
 
 def _save_admin_group(user_id: int, group_id: int):
+    global _linked_groups_cache
     groups = _load_admin_groups()
     groups[str(user_id)] = group_id
-    with open(ADMIN_GROUPS_FILE, "w", encoding="utf-8") as f:
-        json.dump(groups, f)
+    STORAGE.save_admin_group(user_id, group_id, groups)
+    # The admin may have moved from another group; rebuilt on writes only.
+    _linked_groups_cache = set(groups.values())
+    if ANNOUNCER:
+        ANNOUNCER.ensure(group_id)
+
+def _remove_admin_group_chat(group_id: int) -> None:
+    # Unlinks every admin from a group the bot can no longer post to.
+    groups = _load_admin_groups()
+    for user_id in [u for u, g in groups.items() if g == group_id]:
+        del groups[user_id]
+    _linked_groups_cache.discard(group_id)
+    STORAGE.remove_group(group_id, groups)
+    if ANNOUNCER:
+        ANNOUNCER.remove(group_id)
 
 async def set_announce_interval(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -65,38 +101,109 @@ async def set_announce_interval(update: Update, context: ContextTypes.DEFAULT_TY
     minutes = int(args[0])
     if minutes < 1:
         return await update.message.reply_text("Interval must be at least 1 minute.")
-    _save_announce_interval(minutes)
+    _save_announce_interval(minutes, _announce_group_for(update))
     await update.message.reply_text(f"Announcement interval set to {minutes} minutes.")
 
-def _save_announce_interval(interval: int) -> None:
-    settings = _load_announce_settings()
+def _save_announce_interval(interval: int, group_id: Optional[int] = None) -> None:
+    settings = _load_announce_settings(group_id)
     message = settings.get("message", "A giveaway is active! DM this bot and use /start to enter.")
-    with open(ANNOUNCE_SETTINGS_FILE, "w", encoding="utf-8") as f:
-        json.dump({"interval": interval, "message": message}, f)
+    _save_announce_settings(interval, message, group_id)
 
 ANNOUNCE_SETTINGS_FILE = "announce_settings.json"
+# (defaults, {group_id: settings}); groups without an entry use the defaults.
+_announce_settings_cache = None
 
+def _announce_group_for(update: Update) -> Optional[int]:
+    # In a group the settings apply to that group; in private chat, to the
+    # group the admin is linked to.
+    chat = update.effective_chat
+    if chat and chat.type in ["group", "supergroup"]:
+        return chat.id
+    return _load_admin_groups().get(str(update.effective_user.id))
 
-def _load_announce_settings() -> dict:
-    if not os.path.exists(ANNOUNCE_SETTINGS_FILE):
-        return {"interval": 15, "message": "A giveaway is active! DM this bot and use /start to enter."}
+def _group_giveaway(group_id: int) -> int:
+    # The giveaway a group's admins and entrants use: its own, or giveaway 0
+    # while that is running and the group hasn't had one of its own yet.
+    # Before giveaways were per group, every linked group shared giveaway 0,
+    # and one running across the upgrade stays reachable this way.
+    if group_id != DEFAULT_GIVEAWAY and _is_active(DEFAULT_GIVEAWAY) and _load(group_id)["seq"] == 0:
+        return DEFAULT_GIVEAWAY
+    return group_id
+
+def _giveaway_for(update: Update) -> int:
+    # The giveaway an admin action applies to, chosen the same way.
+    group_id = _announce_group_for(update)
+    return DEFAULT_GIVEAWAY if group_id is None else _group_giveaway(group_id)
+
+def _known_group(value) -> Optional[int]:
+    # A group id from a deep link or an entry button, if it names a linked
+    # group or a running giveaway. Anyone can make one up, and
+    # loading a made-up id would keep an empty state in memory for good.
     try:
-        with open(ANNOUNCE_SETTINGS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            return {
-                "interval": int(data.get("interval", 15)),
-                "message": str(data.get("message", "A giveaway is active! DM this bot and use /start to enter."))
-            }
-    except:
-        return {"interval": 15, "message": "A giveaway is active! DM this bot and use /start to enter."}
+        group_id = int(value)
+    except (TypeError, ValueError):
+        return None
+    if group_id in _linked_groups() or _is_active(group_id):
+        return _group_giveaway(group_id)
+    return None
 
-def _save_announce_settings(interval: int, message: str) -> None:
-    with open(ANNOUNCE_SETTINGS_FILE, "w", encoding="utf-8") as f:
-        json.dump({"interval": interval, "message": message}, f)
+def _entry_group(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    # Which group's giveaway a DM is about: the one in the /start deep link,
+    # else the last one this user opened, else the only one running.
+    args = getattr(context, "args", None) or []
+    if args and _known_group(args[0]) is not None:
+        context.user_data["giveaway_group"] = int(args[0])
+    group_id = context.user_data.get("giveaway_group")
+    if group_id is None:
+        active = _active_groups()
+        group_id = next(iter(active)) if len(active) == 1 else DEFAULT_GIVEAWAY
+    return _group_giveaway(group_id)
+
+def _load_all_announce_settings() -> Tuple[dict, Dict[int, dict]]:
+    global _announce_settings_cache
+    if _announce_settings_cache is not None and not _config_changed("announce_settings"):
+        return _announce_settings_cache
+    old, _announce_settings_cache = _announce_settings_cache, STORAGE.load_announce_settings()
+    if old is not None and ANNOUNCER:
+        # Changed on another worker: reschedule what changed, as if set here.
+        defaults, groups = _announce_settings_cache
+        if defaults != old[0]:
+            ANNOUNCER.settings_changed(None)
+        for group_id in set(groups) | set(old[1]):
+            if groups.get(group_id) != old[1].get(group_id):
+                ANNOUNCER.settings_changed(group_id)
+    return _announce_settings_cache
+
+def _load_announce_settings(group_id: Optional[int] = None) -> dict:
+    defaults, groups = _load_all_announce_settings()
+    return groups.get(group_id, defaults)
+
+def _save_announce_settings(interval: int, message: str, group_id: Optional[int] = None) -> None:
+    defaults, groups = _load_all_announce_settings()
+    settings = {"interval": interval, "message": message}
+    if group_id is None:
+        defaults.update(settings)
+    else:
+        groups[group_id] = settings
+    STORAGE.save_announce_settings(group_id, settings, defaults, groups)
+    if ANNOUNCER:
+        ANNOUNCER.settings_changed(group_id)
+
+def _reset_announce_settings(group_id: Optional[int] = None) -> None:
+    defaults, groups = _load_all_announce_settings()
+    if group_id is None:
+        defaults.update(DEFAULT_ANNOUNCE_SETTINGS)
+        settings = defaults
+    else:
+        groups.pop(group_id, None)
+        settings = None
+    STORAGE.save_announce_settings(group_id, settings, defaults, groups)
+    if ANNOUNCER:
+        ANNOUNCER.settings_changed(group_id)
 async def show_announce_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin(update.effective_user.id, update, context):
         return await update.message.reply_text("Unauthorized.")
-    settings = _load_announce_settings()
+    settings = _load_announce_settings(_announce_group_for(update))
     await update.message.reply_text(f"Current announcement interval: {settings['interval']} minutes\nCurrent message: {settings['message']}")
 
 
@@ -108,52 +215,1860 @@ TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 ADMIN_IDS = {int(x.strip()) for x in os.getenv("ADMIN_IDS", "0").split(",") if x.strip().isdigit()}
 STATE_FILE = "giveaway.json"
 
-LOCK = asyncio.Lock()
+log = logging.getLogger("giveaway_bot")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+class Metrics:
+    # Counters and latency histograms keyed by name and labels. Histograms use
+    # fixed buckets, so recording a sample is one bisect and a few adds.
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.counters: Dict[Tuple[str, tuple], float] = {}
+        # Per key: one count per bucket plus +Inf, then the sum of samples.
+        self.histograms: Dict[Tuple[str, tuple], List[float]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        h = self.histograms.get(key)
+        if h is None:
+            h = self.histograms[key] = [0] * (len(self.BUCKETS) + 2)
+        h[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        h[-1] += seconds
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def quantile(self, h: List[float], q: float) -> float:
+        # Upper bound of the bucket holding the q-th sample.
+        rank = q * sum(h[:-1])
+        seen = 0
+        for bound, n in zip(self.BUCKETS + (float("inf"),), h[:-1]):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    @staticmethod
+    def _labels(labels: tuple, extra: str = "") -> str:
+        parts = [f'{k}="{v}"' for k, v in labels] + ([extra] if extra else [])
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> str:
+        # Prometheus text exposition format.
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), h in sorted(self.histograms.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, n in zip(self.BUCKETS + ("+Inf",), h[:-1]):
+                cumulative += n
+                le = 'le="%s"' % bound
+                lines.append(f"{name}_bucket{self._labels(labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{self._labels(labels)} {h[-1]}")
+            lines.append(f"{name}_count{self._labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+
+@contextmanager
+def _handler_metrics(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        METRICS.inc("giveaway_handler_errors_total", handler=name)
+        raise
+    finally:
+        METRICS.observe("giveaway_handler_seconds", time.perf_counter() - t0, handler=name)
+
+def _instrumented(func):
+    @functools.wraps(func)
+    async def wrapper(update, context):
+        with _handler_metrics(func.__name__.lstrip("_")):
+            return await func(update, context)
+    return wrapper
+
+class TimedLock(asyncio.Lock):
+    # Records how long each acquire waited for the lock.
+    def __init__(self, name: str):
+        super().__init__()
+        self.name = name
+
+    async def acquire(self):
+        t0 = time.perf_counter()
+        result = await super().acquire()
+        METRICS.observe("giveaway_lock_wait_seconds", time.perf_counter() - t0, lock=self.name)
+        return result
+
+# Each lock guards one piece of in-memory state and is never held across a
+# Telegram API call. Take ENTRIES_LOCK before WINNERS_LOCK when both are needed.
+ENTRIES_LOCK = TimedLock("entries")
+WINNERS_LOCK = TimedLock("winners")
+BUTTONS_LOCK = TimedLock("buttons")
+ADMIN_GROUPS_LOCK = TimedLock("admin_groups")
 PICK_SPECIFIC = 1
+JOURNAL_FILE = "giveaway.journal"
+JOURNAL_COMPACT_EVERY = int(os.getenv("JOURNAL_COMPACT_EVERY", "1000"))
+
+# Each group runs its own giveaway, keyed by chat_id. Admins who haven't
+# linked a group, and state from before giveaways were per group, use
+# giveaway 0, which keeps the original STATE_FILE and JOURNAL_FILE.
+DEFAULT_GIVEAWAY = 0
+GIVEAWAYS_DIR = os.getenv("GIVEAWAYS_DIR", "giveaways")
+
+# The in-memory state is authoritative. A group's state is loaded on first
+# use; mutations are queued per group and written behind, at most
+# STATE_MAX_STALENESS seconds after the first unflushed one.
+STATE_MAX_STALENESS = float(os.getenv("STATE_MAX_STALENESS", "1.0"))
+_STATES: Dict[int, Dict[str, Any]] = {}
+_pending_ops: Dict[int, List[Dict[str, Any]]] = {}
+_flush_task = None
+
+# Snapshot columns are packed so a big pool loads without parsing millions of
+# JSON values: integers as base64 of their little-endian bytes, strings as
+# each distinct value once, "\0"-separated, plus an index column unless every
+# value is distinct. Snapshots
+# written before packing hold plain lists, which still load.
+def _pack_ints(col: array) -> str:
+    if sys.byteorder == "big":
+        col = col[:]
+        col.byteswap()
+    return base64.b64encode(col.tobytes()).decode("ascii")
+
+def _unpack_ints(data, typecode: str = "q") -> array:
+    if isinstance(data, list):
+        return array(typecode, data)
+    col = array(typecode, base64.b64decode(data))
+    if sys.byteorder == "big":
+        col.byteswap()
+    return col
+
+def _pack_strs(col: List[str]):
+    table = dict.fromkeys(col)
+    values = "\0".join(table)
+    # Telegram names can't hold "\0"; should one turn up, keep the list.
+    if not col or values.count("\0") != len(table) - 1:
+        return list(col)
+    if len(table) == len(col):
+        return {"values": values}
+    pos = {v: i for i, v in enumerate(table)}
+    return {"values": values, "index": _pack_ints(array("i", map(pos.__getitem__, col)))}
+
+def _unpack_strs(data, intern: bool = True) -> List[str]:
+    # Packed columns share one object per distinct value already.
+    if isinstance(data, list):
+        return [sys.intern(v) for v in data] if intern else data
+    table = data["values"].split("\0")
+    if "index" not in data:
+        return table
+    return list(map(table.__getitem__, _unpack_ints(data["index"], "i")))
+
+class EntryStore:
+    # Entries in arrival order, stored by column: user ids, numbers and weights
+    # in array('q'), names in plain lists with first and last names interned,
+    # since the same few thousand recur across a big pool. Nothing is kept per
+    # entry but the column cells and its user_id -> slot index item. Each
+    # entry keeps the number it was given on entry; a removed slot is
+    # tombstoned with number 0 so nobody's number shifts, and the columns are
+    # compacted once tombstones outnumber live entries.
+    COLUMNS = ["user_id", "number", "weight", "username", "first_name", "last_name"]
+
+    def __init__(self, entries=(), next_number: int = 1):
+        self.user_ids = array("q")
+        self.numbers = array("q")
+        self.weights = array("q")
+        self.usernames: List[str] = []
+        self.first_names: List[str] = []
+        self.last_names: List[str] = []
+        self._index: Dict[int, int] = {}
+        self._dead: List[int] = []  # tombstoned slots, in order
+        self.next_number = next_number
+        for e in entries:
+            self.add(e)
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, Any], next_number: int = 1) -> "EntryStore":
+        # Inverse of to_columns(); builds each column in one go.
+        store = cls(next_number=next_number)
+        store.user_ids = _unpack_ints(columns["user_id"])
+        store.numbers = _unpack_ints(columns["number"])
+        weights = columns.get("weight")
+        store.weights = _unpack_ints(weights) if weights else array("q", [1]) * len(store.user_ids)
+        store.usernames = _unpack_strs(columns["username"], intern=False)
+        store.first_names = _unpack_strs(columns["first_name"])
+        store.last_names = _unpack_strs(columns["last_name"])
+        store._index = dict(zip(store.user_ids, range(len(store.user_ids))))
+        if store.numbers:
+            store.next_number = max(next_number, store.numbers[-1] + 1)
+        return store
+
+    def to_columns(self) -> Dict[str, Any]:
+        # Live entries, column by column and packed; the weight column is left
+        # out while every weight is 1.
+        if self._dead:
+            self._compact()
+        columns = {
+            "user_id": _pack_ints(self.user_ids), "number": _pack_ints(self.numbers),
+            "username": _pack_strs(self.usernames), "first_name": _pack_strs(self.first_names), "last_name": _pack_strs(self.last_names),
+        }
+        if self.weights.count(1) != len(self.weights):
+            columns["weight"] = _pack_ints(self.weights)
+        return columns
+
+    def copy(self) -> "EntryStore":
+        # Independent of later changes, so another thread can walk it.
+        store = EntryStore(next_number=self.next_number)
+        store.user_ids, store.numbers, store.weights = self.user_ids[:], self.numbers[:], self.weights[:]
+        store.usernames, store.first_names, store.last_names = self.usernames[:], self.first_names[:], self.last_names[:]
+        store._index = self._index.copy()
+        store._dead = self._dead[:]
+        return store
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __iter__(self):
+        return (self._entry(i) for i in range(len(self.numbers)) if self.numbers[i])
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._index
+
+    def _entry(self, pos: int) -> Dict[str, Any]:
+        entry = {"user_id": self.user_ids[pos], "username": self.usernames[pos], "first_name": self.first_names[pos],
+                 "last_name": self.last_names[pos], "number": self.numbers[pos]}
+        if self.weights[pos] != 1:
+            entry["weight"] = self.weights[pos]
+        return entry
+
+    def add(self, entry: Dict[str, Any]) -> int:
+        if "number" not in entry:
+            entry["number"] = self.next_number
+        self.next_number = max(self.next_number, entry["number"] + 1)
+        self._index[entry["user_id"]] = len(self.numbers)
+        self.user_ids.append(entry["user_id"])
+        self.numbers.append(entry["number"])
+        self.weights.append(entry.get("weight", 1))
+        self.usernames.append(entry.get("username", ""))
+        self.first_names.append(sys.intern(entry.get("first_name", "")))
+        self.last_names.append(sys.intern(entry.get("last_name", "")))
+        return entry["number"]
+
+    def number_of(self, user_id: int) -> Optional[int]:
+        pos = self._index.get(user_id)
+        return None if pos is None else self.numbers[pos]
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        # A copy; change entries through the store.
+        pos = self._index.get(user_id)
+        return None if pos is None else self._entry(pos)
+
+    def set_weight(self, user_id: int, weight: int) -> bool:
+        pos = self._index.get(user_id)
+        if pos is None:
+            return False
+        self.weights[pos] = weight
+        return True
+
+    def remove(self, user_id: int) -> Optional[Dict[str, Any]]:
+        pos = self._index.pop(user_id, None)
+        if pos is None:
+            return None
+        entry = self._entry(pos)
+        self.numbers[pos] = 0
+        self.usernames[pos] = self.first_names[pos] = self.last_names[pos] = ""
+        bisect.insort(self._dead, pos)
+        if len(self._dead) > len(self._index):
+            self._compact()
+        return entry
+
+    def pool_columns(self) -> Tuple[array, array, array]:
+        # (numbers, user_ids, weights) of the live entries, in entry order.
+        # Copied a run of live slots at a time, between tombstones.
+        cols = (self.numbers, self.user_ids, self.weights)
+        out = (array("q"), array("q"), array("q"))
+        prev = 0
+        for pos in self._dead + [len(self.numbers)]:
+            for o, col in zip(out, cols):
+                o.extend(col[prev:pos])
+            prev = pos + 1
+        return out
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        return list(self)
+
+    # Pages are fixed ranges of slots, so fetching one costs O(size) however
+    # large the store is. Tombstones can leave a page short.
+    def page_count(self, size: int) -> int:
+        return -(-len(self.numbers) // size)
+
+    def page(self, page: int, size: int) -> List[Dict[str, Any]]:
+        return [self._entry(i) for i in range(page * size, min((page + 1) * size, len(self.numbers))) if self.numbers[i]]
+
+    def _compact(self) -> None:
+        live = self.numbers
+        self.user_ids, self.weights = (array("q", itertools.compress(col, live)) for col in (self.user_ids, self.weights))
+        self.usernames, self.first_names, self.last_names = (
+            list(itertools.compress(col, live)) for col in (self.usernames, self.first_names, self.last_names))
+        self.numbers = array("q", itertools.compress(live, live))
+        self._index = dict(zip(self.user_ids, range(len(self.user_ids))))
+        self._dead = []
+
+class FenwickTree:
+    # Prefix sums over integer weights. find() maps a point in [0, total) to the
+    # index whose cumulative range contains it, so a weighted pick without
+    # replacement is one find() plus one add() of minus the weight.
+    def __init__(self, weights: List[int]):
+        n = len(weights)
+        tree = [0] + list(weights)
+        for i in range(1, n + 1):
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+        self._tree = tree
+        self._top = 1 << (n.bit_length() - 1) if n else 0
+        self.total = sum(weights)
+
+    def add(self, i: int, delta: int) -> None:
+        self.total += delta
+        i += 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def find(self, target: int) -> int:
+        pos = 0
+        step = self._top
+        while step:
+            nxt = pos + step
+            if nxt < len(self._tree) and self._tree[nxt] <= target:
+                pos = nxt
+                target -= self._tree[nxt]
+            step >>= 1
+        return pos
+
+def _blank_state(group_id: int = DEFAULT_GIVEAWAY) -> Dict[str, Any]:
+    return {"group_id": group_id, "active": False, "entries": EntryStore(), "winners": [], "draws": [], "server_seed": None, "commitment": None, "seq": 0}
+
+def _enter(state: Dict[str, Any], user) -> Tuple[int, bool]:
+    # Returns (entry number, newly entered).
+    number = state["entries"].number_of(user.id)
+    if number is not None:
+        return number, False
+    entry = {"user_id": user.id, "username": user.username or "", "first_name": user.first_name or "", "last_name": user.last_name or ""}
+    _commit(state, {"op": "enter", "entry": entry})
+    return entry["number"], True
+
+class DrawRng:
+    # HMAC-SHA256 in counter mode, keyed by the giveaway's server seed and bound
+    # to one draw by the nonce. randbelow() rejects out-of-range values, so
+    # every index is exactly equally likely.
+    def __init__(self, key: bytes, nonce: bytes):
+        self._key = key
+        self._nonce = nonce
+        self._counter = 0
+        self._buf = b""
+
+    def _bytes(self, n: int) -> bytes:
+        while len(self._buf) < n:
+            self._buf += hmac.new(self._key, self._nonce + self._counter.to_bytes(8, "big"), hashlib.sha256).digest()
+            self._counter += 1
+        out, self._buf = self._buf[:n], self._buf[n:]
+        return out
+
+    def randbelow(self, n: int) -> int:
+        bits = (n - 1).bit_length()
+        if bits == 0:
+            return 0
+        while True:
+            r = int.from_bytes(self._bytes((bits + 7) // 8), "big") >> (-bits % 8)
+            if r < n:
+                return r
+
+def _new_commitment() -> Dict[str, Any]:
+    seed = secrets.token_hex(32)
+    return {"op": "commit", "server_seed": seed, "commitment": hashlib.sha256(bytes.fromhex(seed)).hexdigest()}
+
+def _pool_columns(entries: "EntryStore") -> Tuple[array, array, array]:
+    # (numbers, user_ids, weights) in entry order: everything a draw depends on.
+    return entries.pool_columns()
+
+def _pool_digest(columns: Tuple[array, array, array]) -> str:
+    h = hashlib.sha256()
+    for col in columns:
+        if sys.byteorder == "big":
+            col = array("q", col)
+            col.byteswap()
+        h.update(col.tobytes())
+    return h.hexdigest()
+
+def _splice(columns: Tuple[array, array, array], end: int, cuts: List[int], rows: List[Tuple[int, int, int]] = ()) -> Tuple[array, array, array]:
+    # Copies columns[:end] with the sorted positions in cuts left out, or with
+    # rows inserted at them, in slices rather than one item at a time.
+    out = (array("q"), array("q"), array("q"))
+    prev = 0
+    for n, pos in enumerate(cuts):
+        for o, col in zip(out, columns):
+            o.extend(col[prev:pos])
+        if rows:
+            for o, v in zip(out, rows[n]):
+                o.append(v)
+            prev = pos
+        else:
+            prev = pos + 1
+    for o, col in zip(out, columns):
+        o.extend(col[prev:end])
+    return out
+
+def _draw_rng(server_seed: str, entries_digest: str, draw: int) -> DrawRng:
+    return DrawRng(bytes.fromhex(server_seed), bytes.fromhex(entries_digest) + draw.to_bytes(8, "big"))
+
+def _select(weights: List[int], k: int, rng: DrawRng) -> List[int]:
+    # Indices of up to k distinct picks. Equal weights use Floyd's sampling,
+    # O(k); otherwise a Fenwick tree, O(n + k log n).
+    n = len(weights)
+    if weights.count(1) == n:
+        chosen: Dict[int, None] = {}
+        for j in range(n - min(k, n), n):
+            t = rng.randbelow(j + 1)
+            chosen[j if t in chosen else t] = None
+        return list(chosen)
+    tree = FenwickTree(list(weights))
+    picked = []
+    while len(picked) < k and tree.total > 0:
+        i = tree.find(rng.randbelow(tree.total))
+        picked.append(i)
+        tree.add(i, -weights[i])
+    return picked
+
+def _draw_order(weights: List[int], rng: DrawRng):
+    # Yields every index once, in a random order where each next index is
+    # picked with probability proportional to its weight among those left.
+    # Equal weights use a lazy Fisher-Yates shuffle, O(1) per index.
+    n = len(weights)
+    if weights.count(1) == n:
+        moved: Dict[int, int] = {}
+        for j in range(n):
+            t = j + rng.randbelow(n - j)
+            yield moved.get(t, t)
+            moved[t] = moved.get(j, j)
+        return
+    tree = FenwickTree(list(weights))
+    while tree.total > 0:
+        i = tree.find(rng.randbelow(tree.total))
+        tree.add(i, -weights[i])
+        yield i
+
+def _select_skipping(weights: List[int], k: int, rng: DrawRng, skip: Callable[[int], bool]) -> Tuple[List[int], List[int]]:
+    # The first k indices in draw order that skip() lets through, and the
+    # skipped indices met on the way. Skipping one doesn't change the order,
+    # so the winners after it stay where they were.
+    picked: List[int] = []
+    skipped: List[int] = []
+    if k > 0:
+        for i in _draw_order(weights, rng):
+            (skipped if skip(i) else picked).append(i)
+            if len(picked) == k:
+                break
+    return picked, skipped
+
+def _draw(state: Dict[str, Any], k: int, excluded: Optional[Callable[[int], bool]] = None,
+          next_number: Optional[int] = None) -> Dict[str, Any]:
+    # Builds the op for one draw of up to k winners. Every field follows from
+    # the committed server seed and the pool, so the draw can be replayed.
+    # With group membership checked, users for whom excluded(user id) holds
+    # are passed over in draw order and listed in the record. With next_number,
+    # entries numbered from there on are left out of the pool.
+    entries = state["entries"]
+    columns = _pool_columns(entries)
+    if next_number is None:
+        next_number = entries.next_number
+    else:
+        end = bisect.bisect_left(columns[0], next_number)
+        columns = tuple(col[:end] for col in columns)
+    numbers, user_ids, weights = columns
+    digest = _pool_digest(columns)
+    draw = len(state["draws"]) + 1
+    rng = _draw_rng(state["server_seed"], digest, draw)
+    if excluded is None:
+        indices = _select(weights, k, rng)
+    else:
+        indices, skipped = _select_skipping(weights, k, rng, lambda i: excluded(user_ids[i]))
+    op = {
+        "op": "draw", "draw": draw, "commitment": state["commitment"], "entries_digest": digest,
+        "pool_size": len(numbers), "next_number": next_number, "k": k, "indices": indices,
+        "winners": [[user_ids[i], numbers[i], weights[i]] for i in indices], "timestamp": int(time.time()),
+    }
+    if excluded is not None:
+        op["excluded"] = [user_ids[i] for i in skipped]
+    return op
+
+DRAW_AUDIT_FILE = os.getenv("DRAW_AUDIT_FILE", "draw_audit.jsonl")
+
+def _audit(kind: str, record: Dict[str, Any]) -> None:
+    # Append-only: unlike the journal, this file is never compacted or rewritten.
+    line = dict({k: v for k, v in record.items() if k not in ("op", "seq")}, type=kind)
+    with open(DRAW_AUDIT_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps(line, separators=(",", ":")) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def _commit_seed(state: Dict[str, Any]) -> None:
+    op = _new_commitment()
+    _commit(state, op)
+    _audit("commit", {"commitment": op["commitment"], "timestamp": int(time.time())})
+
+def _reveal_seed(state: Dict[str, Any]) -> None:
+    if state.get("server_seed"):
+        _audit("reveal", {"commitment": state["commitment"], "server_seed": state["server_seed"], "timestamp": int(time.time())})
+
+def _commit_draw(state: Dict[str, Any], k: int, excluded: Optional[Callable[[int], bool]] = None,
+                 unchecked: Optional[Callable[[int], bool]] = None, next_number: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    # Caller holds ENTRIES_LOCK and WINNERS_LOCK. The draw is persisted before
+    # it is returned, so no winner is announced that a crash could lose. If
+    # unchecked(user id) holds for any winner, nothing is committed and the
+    # draw comes back with those users under "unchecked".
+    with _transaction(state):
+        if state.get("commitment") is None:
+            # Giveaway started before draws were committed to.
+            _commit_seed(state)
+        op = _draw(state, k, excluded, next_number)
+        if not op["winners"]:
+            return None
+        if unchecked is not None:
+            pending = [user_id for user_id, _, _ in op["winners"] if unchecked(user_id)]
+            if pending:
+                return dict(op, unchecked=pending)
+        _commit(state, op)
+        _flush()
+    _audit("draw", op)
+    return op
+
+def verify_draws(state: Dict[str, Any], records: List[Dict[str, Any]]) -> Tuple[int, List[str]]:
+    # Replays every draw of the state's giveaway from the audit log and returns
+    # (draws checked, problems). The pool each draw saw is rebuilt from the live
+    # entries plus the winners recorded in the log.
+    commitment = state.get("commitment")
+    records_for_commitment = [r for r in records if r.get("commitment") == commitment]
+    seed = next((r["server_seed"] for r in records_for_commitment if r["type"] == "reveal"), state.get("server_seed"))
+    if not seed or hashlib.sha256(bytes.fromhex(seed)).hexdigest() != commitment:
+        return 0, [f"server seed does not match commitment {commitment}"]
+    draws = [r for r in records_for_commitment if r["type"] == "draw"]
+    live = _pool_columns(state["entries"])
+    drawn = sorted((number, user_id, weight) for d in draws for user_id, number, weight in d["winners"])
+    everyone = _splice(live, len(live[0]), [bisect.bisect_left(live[0], r[0]) for r in drawn], drawn)
+    problems = []
+    removed: List[int] = []
+    for d in draws:
+        end = bisect.bisect_left(everyone[0], d["next_number"])
+        numbers, user_ids, weights = pool = _splice(everyone, end, [bisect.bisect_left(everyone[0], n) for n in sorted(removed)])
+        digest = _pool_digest(pool)
+        if digest != d["entries_digest"]:
+            problems.append(f"draw {d['draw']}: pool digest {digest} does not match the recorded {d['entries_digest']}")
+        else:
+            rng = _draw_rng(seed, digest, d["draw"])
+            if "excluded" in d:
+                out = set(d["excluded"])
+                indices, skipped = _select_skipping(weights, d["k"], rng, lambda i: user_ids[i] in out)
+                if [user_ids[i] for i in skipped] != d["excluded"]:
+                    problems.append(f"draw {d['draw']}: excluded users don't match the replay")
+            else:
+                indices = _select(weights, d["k"], rng)
+            if indices != d["indices"] or [[user_ids[i], numbers[i], weights[i]] for i in indices] != d["winners"]:
+                problems.append(f"draw {d['draw']}: replay picked different winners")
+        removed.extend(w[1] for w in d["winners"])
+    return len(draws), problems
+
+def verify_draws_cli(path: str, group_id: int = DEFAULT_GIVEAWAY) -> bool:
+    started = time.perf_counter()
+    state = STORAGE.load_state(group_id)
+    with open(path, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    count, problems = verify_draws(state, records)
+    for p in problems:
+        log.error("%s", p)
+    log.info("Checked %s draws against %s live entries in %.1f ms: %s", count, len(state['entries']), (time.perf_counter() - started) * 1000, 'FAILED' if problems else 'OK')
+    return not problems
+
+ENTRY_BATCH_WINDOW = float(os.getenv("ENTRY_BATCH_WINDOW_MS", "5")) / 1000
+ENTRY_BATCH_MAX = int(os.getenv("ENTRY_BATCH_MAX", "500"))
+
+class EntryBatcher:
+    # Group commit for entry clicks. Callers enqueue and await a future; one
+    # writer task collects requests for up to ENTRY_BATCH_WINDOW (or until
+    # ENTRY_BATCH_MAX are waiting), applies them, persists the whole batch
+    # with a single write and only then resolves each future with
+    # (entry number, newly entered). The number is None if no giveaway is active.
+    def __init__(self):
+        self._queue: List[Tuple[Any, asyncio.Future]] = []
+        self._full = asyncio.Event()
+        self._task = None
+
+    async def submit(self, user, group_id: int = DEFAULT_GIVEAWAY) -> Tuple[Optional[int], bool]:
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.append(((user, group_id), fut))
+        if len(self._queue) >= ENTRY_BATCH_MAX:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return await fut
+
+    async def _run(self) -> None:
+        while self._queue:
+            try:
+                await asyncio.wait_for(self._full.wait(), ENTRY_BATCH_WINDOW)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            batch = self._queue[:ENTRY_BATCH_MAX]
+            del self._queue[:len(batch)]
+            try:
+                async with ENTRIES_LOCK:
+                    with _transaction():
+                        results = []
+                        for (user, group_id), _ in batch:
+                            s = _load(group_id)
+                            results.append(_enter(s, user) if s["active"] else (None, False))
+                        _flush()
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for (_, fut), result in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(result)
 
-def _blank_state() -> Dict[str, Any]:
-    return {"active": False, "entries": [], "winners": []}
+ENTRY_BATCHER = EntryBatcher()
 
-def _load() -> Dict[str, Any]:
-    if not os.path.exists(STATE_FILE): return _blank_state()
+def _apply_op(state: Dict[str, Any], op: Dict[str, Any]) -> None:
+    kind = op["op"]
+    if kind == "enter":
+        state["entries"].add(op["entry"])
+    elif kind == "pick":
+        winner = state["entries"].remove(op["user_id"])
+        if winner is not None:
+            state["winners"].append(winner)
+    elif kind == "draw":
+        for user_id, _, _ in op["winners"]:
+            winner = state["entries"].remove(user_id)
+            if winner is not None:
+                state["winners"].append(winner)
+        state["draws"].append({k: v for k, v in op.items() if k not in ("op", "seq")})
+    elif kind == "commit":
+        state["server_seed"] = op["server_seed"]
+        state["commitment"] = op["commitment"]
+    elif kind == "weight":
+        state["entries"].set_weight(op["user_id"], op["weight"])
+    elif kind == "start":
+        state["active"] = True
+        state["entries"] = EntryStore(next_number=1)
+        state["winners"] = []
+        state["draws"] = []
+        state["server_seed"] = None
+        state["commitment"] = None
+    elif kind == "end":
+        state["active"] = False
+    elif kind == "clear_winners":
+        state["winners"] = []
+    state["seq"] = op["seq"]
+
+def _load(group_id: int = DEFAULT_GIVEAWAY) -> Dict[str, Any]:
+    s = _STATES.get(group_id)
+    if s is None:
+        with METRICS.timer("giveaway_storage_seconds", op="load"):
+            s = _STATES[group_id] = STORAGE.load_state(group_id)
+    elif SHARED_STATE:
+        _sync(s)
+    return s
+
+def _sync(state: Dict[str, Any]) -> None:
+    # A state with unwritten ops is already ahead of the database.
+    if state["group_id"] not in _pending_ops:
+        with METRICS.timer("giveaway_storage_seconds", op="sync"):
+            STORAGE.sync(state)
+
+@contextmanager
+def _transaction(*states: Dict[str, Any]):
+    # Wraps every mutation. With shared state it holds the database write
+    # lock, catches the given states up with other workers and writes the ops
+    # before committing, so the block must not await. Otherwise it does nothing
+    # and ops are written behind as usual.
+    if not SHARED_STATE:
+        yield
+        return
     try:
-        with open(STATE_FILE, "r", encoding="utf-8") as f:
-            s = json.load(f)
-            for k in ["active","entries","winners"]:
-                if k not in s: s[k] = _blank_state()[k]
-            return s
+        with STORAGE.transaction():
+            for s in states:
+                _sync(s)
+            yield
+            _flush()
     except:
-        return _blank_state()
+        # The cache may hold ops that were just rolled back.
+        _STATES.clear()
+        _pending_ops.clear()
+        raise
+
+def _is_active(group_id: int) -> bool:
+    if SHARED_STATE:
+        return STORAGE.is_active(group_id)
+    s = _STATES.get(group_id)
+    return s["active"] if s is not None else group_id in STORAGE.active_groups()
+
+def _active_groups() -> set:
+    # Running giveaways, without loading the state of any that aren't in memory.
+    return {g for g in set(STORAGE.active_groups()) | set(_STATES) if _is_active(g)}
+
+def _flush() -> None:
+    if not _pending_ops:
+        return
+    pending = dict(_pending_ops)
+    _pending_ops.clear()
+    for group_id, ops in pending.items():
+        with METRICS.timer("giveaway_storage_seconds", op="write"):
+            STORAGE.write_ops(group_id, ops, _STATES[group_id])
+
+async def _flush_later() -> None:
+    global _flush_task
+    try:
+        await asyncio.sleep(STATE_MAX_STALENESS)
+    finally:
+        _flush_task = None
+        _flush()
 
-def _save(state: Dict[str, Any]) -> None:
-    tmp = STATE_FILE + ".tmp"
+def _schedule_flush() -> None:
+    global _flush_task
+    if SHARED_STATE:
+        # Inside _transaction() the ops are written when it commits.
+        if not STORAGE.conn.in_transaction:
+            _flush()
+        return
+    if _flush_task is not None:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return _flush()
+    _flush_task = loop.create_task(_flush_later())
+
+def _commit(state: Dict[str, Any], op: Dict[str, Any]) -> None:
+    op["seq"] = state["seq"] + 1
+    _apply_op(state, op)
+    _pending_ops.setdefault(state["group_id"], []).append(op)
+    _schedule_flush()
+
+async def _flush_on_shutdown(app: Application) -> None:
+    if _flush_task is not None:
+        _flush_task.cancel()
+    _flush()
+    STORAGE.close()
+
+def _write_json_atomic(path: str, data: Any, **kwargs) -> None:
+    tmp = path + ".tmp"
     with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
-    os.replace(tmp, STATE_FILE)
+        json.dump(data, f, ensure_ascii=False, **kwargs)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+DEFAULT_ANNOUNCE_SETTINGS = {"interval": 15, "message": "A giveaway is active! DM this bot and use /start to enter."}
+
+ACTIVE_GIVEAWAYS_FILE = "active_giveaways.json"
+
+class JsonStorage:
+    # Every mutation is appended to the group's journal as one JSON line. Once
+    # the journal holds JOURNAL_COMPACT_EVERY records, or as many as there are
+    # entries if more, the group's snapshot is rewritten on a worker thread, so
+    # compaction stays O(1) per record however big the pool.
+    # Giveaway 0 uses STATE_FILE and JOURNAL_FILE, every other group a pair of
+    # files in GIVEAWAYS_DIR. ACTIVE_GIVEAWAYS_FILE lists the running ones so
+    # nobody has to open every group's files to find them. Admin groups,
+    # announcement settings and custom buttons are small and rewritten whole,
+    # atomically.
+    def __init__(self):
+        self._journal_len: Dict[int, int] = {}
+        self._active: Optional[set] = None
+        self._compacting: Dict[int, Future] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @staticmethod
+    def _paths(group_id: int) -> Tuple[str, str]:
+        if group_id == DEFAULT_GIVEAWAY:
+            return STATE_FILE, JOURNAL_FILE
+        return os.path.join(GIVEAWAYS_DIR, f"{group_id}.json"), os.path.join(GIVEAWAYS_DIR, f"{group_id}.journal")
+
+    def group_ids(self) -> List[int]:
+        ids = [DEFAULT_GIVEAWAY]
+        if os.path.isdir(GIVEAWAYS_DIR):
+            ids += sorted({int(name.split(".")[0]) for name in os.listdir(GIVEAWAYS_DIR) if name.endswith((".json", ".journal"))})
+        return ids
+
+    def active_groups(self) -> set:
+        if self._active is None:
+            try:
+                with open(ACTIVE_GIVEAWAYS_FILE, "r", encoding="utf-8") as f:
+                    self._active = set(json.load(f))
+            except:
+                # No index yet: only giveaway 0 can predate it. Write one, so
+                # later starts don't parse that snapshot twice.
+                self._active = {DEFAULT_GIVEAWAY} if self.load_state(DEFAULT_GIVEAWAY)["active"] else set()
+                _write_json_atomic(ACTIVE_GIVEAWAYS_FILE, sorted(self._active))
+        return self._active
+
+    def _note_active(self, state: Dict[str, Any]) -> None:
+        active = self.active_groups()
+        if state["active"] != (state["group_id"] in active):
+            if state["active"]:
+                active.add(state["group_id"])
+            else:
+                active.discard(state["group_id"])
+            _write_json_atomic(ACTIVE_GIVEAWAYS_FILE, sorted(active))
+
+    def load_state(self, group_id: int = DEFAULT_GIVEAWAY) -> Dict[str, Any]:
+        state_file, journal_file = self._paths(group_id)
+        s = _blank_state(group_id)
+        if os.path.exists(state_file):
+            try:
+                with open(state_file, "r", encoding="utf-8") as f:
+                    s = json.load(f)
+                    for k in ["active","entries","winners","draws","server_seed","commitment","seq"]:
+                        if k not in s: s[k] = _blank_state()[k]
+                    # Snapshots from before the columnar format hold a list of entries.
+                    if isinstance(s["entries"], dict):
+                        s["entries"] = EntryStore.from_columns(s["entries"], s.pop("next_number", 1))
+                    else:
+                        s["entries"] = EntryStore(s["entries"], s.pop("next_number", 1))
+                    s["group_id"] = group_id
+            except:
+                s = _blank_state(group_id)
+        # A compaction that didn't finish leaves the journal it superseded.
+        self._journal_len[group_id] = self._replay_journal(s, journal_file + ".old") + self._replay_journal(s, journal_file)
+        return s
+
+    def _replay_journal(self, state: Dict[str, Any], journal_file: str) -> int:
+        # Returns the number of records read. Records at or below the
+        # snapshot's seq are already folded in. A torn last line from a crash
+        # mid-write was never acknowledged; it is cut off, so the next append
+        # doesn't run on from it.
+        if not os.path.exists(journal_file):
+            return 0
+        good = count = 0
+        with open(journal_file, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError
+                    op = json.loads(line)
+                except ValueError:
+                    log.warning("Dropping torn journal record after seq %s", state['seq'])
+                    break
+                good += len(line)
+                count += 1
+                if op.get("seq", 0) > state["seq"]:
+                    _apply_op(state, op)
+        if good < os.path.getsize(journal_file):
+            with open(journal_file, "r+b") as f:
+                f.truncate(good)
+                f.flush()
+                os.fsync(f.fileno())
+        return count
+
+    def write_ops(self, group_id: int, ops: List[Dict[str, Any]], state: Dict[str, Any]) -> None:
+        if any(op["op"] == "start" for op in ops):
+            # The snapshot already contains every queued op.
+            return self.write_snapshot(group_id, state)
+        journal_file = self._paths(group_id)[1]
+        with open(journal_file, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(op, ensure_ascii=False, separators=(",", ":")) + "\n" for op in ops))
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_len[group_id] = self._journal_len.get(group_id, 0) + len(ops)
+        compacting = self._compacting.get(group_id)
+        if self._journal_len[group_id] >= max(JOURNAL_COMPACT_EVERY, len(state["entries"])) and (compacting is None or compacting.done()):
+            self._compact(group_id, state)
+        self._note_active(state)
+
+    def _compact(self, group_id: int, state: Dict[str, Any]) -> None:
+        # Moves the journal aside, so appends go on in a fresh one, and writes a
+        # snapshot of a copy of the state on the worker thread. Only once that
+        # is on disk is the old journal removed. If an earlier compaction
+        # failed, its old journal is still there and the journal joins it.
+        journal_file = self._paths(group_id)[1]
+        superseded = journal_file + ".old"
+        if os.path.exists(superseded):
+            with open(journal_file, "rb") as src, open(superseded, "ab") as dst:
+                dst.write(src.read())
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.remove(journal_file)
+        else:
+            os.replace(journal_file, superseded)
+        self._journal_len[group_id] = 0
+        snapshot = dict(state, entries=state["entries"].copy(), winners=list(state["winners"]), draws=list(state["draws"]))
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="compact")
+        self._compacting[group_id] = self._executor.submit(self._write_snapshot_file, group_id, snapshot, superseded)
+
+    def _write_snapshot_file(self, group_id: int, state: Dict[str, Any], superseded: Optional[str] = None) -> None:
+        state_file = self._paths(group_id)[0]
+        if group_id != DEFAULT_GIVEAWAY:
+            os.makedirs(GIVEAWAYS_DIR, exist_ok=True)
+        snapshot = dict(state, entries=state["entries"].to_columns(), next_number=state["entries"].next_number)
+        try:
+            _write_json_atomic(state_file, snapshot, separators=(",", ":"))
+        except Exception as e:
+            # The old journal stays and is replayed, so nothing is lost.
+            log.error("Writing the snapshot of giveaway %s failed: %s", group_id, e)
+            raise
+        if superseded and os.path.exists(superseded):
+            os.remove(superseded)
+
+    def write_snapshot(self, group_id: int, state: Dict[str, Any]) -> None:
+        # Compact in place: write a full snapshot, then drop every journal it
+        # supersedes. Waits for a compaction already under way, which would
+        # otherwise overwrite this snapshot with an older one.
+        compacting = self._compacting.pop(group_id, None)
+        if compacting is not None:
+            try:
+                compacting.result()
+            except Exception:
+                pass
+        journal_file = self._paths(group_id)[1]
+        self._write_snapshot_file(group_id, state, journal_file + ".old")
+        with open(journal_file, "w", encoding="utf-8"):
+            pass
+        self._journal_len[group_id] = 0
+        self._note_active(state)
+
+    def load_admin_groups(self) -> dict:
+        try:
+            with open(ADMIN_GROUPS_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except:
+            return {}
+
+    def save_admin_group(self, user_id: int, group_id: int, groups: dict) -> None:
+        _write_json_atomic(ADMIN_GROUPS_FILE, groups)
+
+    def remove_group(self, group_id: int, groups: dict) -> None:
+        _write_json_atomic(ADMIN_GROUPS_FILE, groups)
+
+    def load_announce_settings(self) -> Tuple[dict, Dict[int, dict]]:
+        try:
+            with open(ANNOUNCE_SETTINGS_FILE, "r", encoding="utf-8") as f:
+                data = json.load(f)
+                defaults = {
+                    "interval": int(data.get("interval", DEFAULT_ANNOUNCE_SETTINGS["interval"])),
+                    "message": str(data.get("message", DEFAULT_ANNOUNCE_SETTINGS["message"]))
+                }
+                groups = {int(g): {"interval": int(v["interval"]), "message": str(v["message"])} for g, v in data.get("groups", {}).items()}
+                return defaults, groups
+        except:
+            return dict(DEFAULT_ANNOUNCE_SETTINGS), {}
+
+    def save_announce_settings(self, group_id: Optional[int], settings: Optional[dict], defaults: dict, groups: Dict[int, dict]) -> None:
+        _write_json_atomic(ANNOUNCE_SETTINGS_FILE, dict(defaults, groups={str(g): v for g, v in groups.items()}))
+
+    def load_custom_buttons(self) -> list:
+        try:
+            with open(CUSTOM_BUTTONS_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except:
+            return []
+
+    def save_custom_buttons(self, buttons: list) -> None:
+        _write_json_atomic(CUSTOM_BUTTONS_FILE, buttons, indent=2)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+class SqliteStorage:
+    # Same interface as JsonStorage, backed by one SQLite database in WAL mode.
+    # Giveaway tables are keyed by group_id. Each write_ops batch is a single
+    # transaction, with consecutive entries inserted through executemany.
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (
+            group_id INTEGER NOT NULL, key TEXT NOT NULL, value INTEGER NOT NULL, PRIMARY KEY (group_id, key));
+        CREATE TABLE IF NOT EXISTS entries (
+            group_id INTEGER NOT NULL, user_id INTEGER NOT NULL, number INTEGER NOT NULL,
+            username TEXT NOT NULL, first_name TEXT NOT NULL, last_name TEXT NOT NULL,
+            weight INTEGER NOT NULL DEFAULT 1, PRIMARY KEY (group_id, user_id));
+        CREATE UNIQUE INDEX IF NOT EXISTS entries_number ON entries (group_id, number);
+        CREATE TABLE IF NOT EXISTS winners (
+            pos INTEGER PRIMARY KEY AUTOINCREMENT, group_id INTEGER NOT NULL, user_id INTEGER NOT NULL, number INTEGER NOT NULL,
+            username TEXT NOT NULL, first_name TEXT NOT NULL, last_name TEXT NOT NULL,
+            weight INTEGER NOT NULL DEFAULT 1);
+        CREATE INDEX IF NOT EXISTS winners_group ON winners (group_id, pos);
+        CREATE TABLE IF NOT EXISTS draws (id INTEGER PRIMARY KEY AUTOINCREMENT, group_id INTEGER NOT NULL, record TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS draws_group ON draws (group_id, id);
+        CREATE TABLE IF NOT EXISTS draw_seed (
+            group_id INTEGER PRIMARY KEY, server_seed TEXT NOT NULL, commitment TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS admin_groups (user_id INTEGER PRIMARY KEY, group_id INTEGER NOT NULL);
+        CREATE INDEX IF NOT EXISTS admin_groups_group ON admin_groups (group_id);
+        CREATE TABLE IF NOT EXISTS announce_settings (
+            id INTEGER PRIMARY KEY CHECK (id = 0), interval INTEGER NOT NULL, message TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS group_announce_settings (
+            group_id INTEGER PRIMARY KEY, interval INTEGER NOT NULL, message TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS custom_buttons (
+            pos INTEGER PRIMARY KEY, name TEXT NOT NULL, url TEXT NOT NULL, side_by_side INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS config_epoch (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+    """
+    GIVEAWAY_TABLES = ["meta", "entries", "winners", "draws", "draw_seed"]
+    ENTRY_COLUMNS = "user_id, number, username, first_name, last_name, weight"
+
+    def __init__(self, path: str):
+        import sqlite3
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        legacy = self._columns("entries") and "group_id" not in self._columns("entries")
+        if legacy:
+            self._migrate_single_giveaway()
+        else:
+            self.conn.executescript(self.SCHEMA)
+
+    def _columns(self, table: str) -> List[str]:
+        return [r[1] for r in self.conn.execute(f"PRAGMA table_info({table})")]
+
+    @contextmanager
+    def transaction(self):
+        # Nested calls join the transaction that is already open.
+        if self.conn.in_transaction:
+            yield
+            return
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+            self.conn.execute("COMMIT")
+        except:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def _migrate_single_giveaway(self) -> None:
+        # Databases from before giveaways were per group hold one giveaway; it
+        # becomes DEFAULT_GIVEAWAY. Old tables are renamed, copied and dropped.
+        c = self.conn
+        with self.transaction():
+            old = [t for t in self.GIVEAWAY_TABLES if self._columns(t)]
+            c.execute("DROP INDEX IF EXISTS entries_number")
+            for t in old:
+                c.execute(f"ALTER TABLE {t} RENAME TO {t}_v1")
+            for statement in self.SCHEMA.split(";"):
+                if statement.strip():
+                    c.execute(statement)
+            g = DEFAULT_GIVEAWAY
+            c.execute("INSERT INTO meta (group_id, key, value) SELECT ?, key, value FROM meta_v1", (g,))
+            for t in ["entries", "winners"]:
+                weight = "weight" if "weight" in self._columns(f"{t}_v1") else "1"
+                c.execute(f"INSERT INTO {t} (group_id, {self.ENTRY_COLUMNS}) SELECT ?, user_id, number, username, first_name, last_name, {weight} FROM {t}_v1", (g,))
+            if "draws" in old and "record" in self._columns("draws_v1"):
+                c.execute("INSERT INTO draws (group_id, record) SELECT ?, record FROM draws_v1 ORDER BY id", (g,))
+            if "draw_seed" in old:
+                c.execute("INSERT INTO draw_seed (group_id, server_seed, commitment) SELECT ?, server_seed, commitment FROM draw_seed_v1", (g,))
+            for t in old:
+                c.execute(f"DROP TABLE {t}_v1")
+        log.info("Migrated the single-giveaway database to per-group giveaways")
+
+    def _meta(self, group_id: int) -> Dict[str, int]:
+        return dict(self.conn.execute("SELECT key, value FROM meta WHERE group_id = ?", (group_id,)))
+
+    @staticmethod
+    def _row(group_id: int, entry: Dict[str, Any]) -> tuple:
+        return (group_id, entry["user_id"], entry["number"], entry["username"], entry["first_name"], entry["last_name"], entry.get("weight", 1))
+
+    @staticmethod
+    def _entry(row) -> Dict[str, Any]:
+        entry = {"user_id": row[0], "username": row[2], "first_name": row[3], "last_name": row[4], "number": row[1]}
+        if row[5] != 1:
+            entry["weight"] = row[5]
+        return entry
+
+    @staticmethod
+    def _draw_row(group_id: int, draw: Dict[str, Any]) -> tuple:
+        return (group_id, json.dumps({k: v for k, v in draw.items() if k not in ("op", "seq")}, separators=(",", ":")))
+
+    def group_ids(self) -> List[int]:
+        return [g for g, in self.conn.execute("SELECT DISTINCT group_id FROM meta ORDER BY group_id")]
+
+    def active_groups(self) -> set:
+        return {g for g, in self.conn.execute("SELECT group_id FROM meta WHERE key = 'active' AND value = 1")}
+
+    def is_active(self, group_id: int) -> bool:
+        row = self.conn.execute("SELECT value FROM meta WHERE group_id = ? AND key = 'active'", (group_id,)).fetchone()
+        return bool(row and row[0])
+
+    def load_state(self, group_id: int = DEFAULT_GIVEAWAY) -> Dict[str, Any]:
+        meta = self._meta(group_id)
+        rows = self.conn.execute(f"SELECT {self.ENTRY_COLUMNS} FROM entries WHERE group_id = ? ORDER BY number", (group_id,))
+        winners = self.conn.execute(f"SELECT {self.ENTRY_COLUMNS} FROM winners WHERE group_id = ? ORDER BY pos", (group_id,))
+        draws = self.conn.execute("SELECT record FROM draws WHERE group_id = ? ORDER BY id", (group_id,))
+        seed = self.conn.execute("SELECT server_seed, commitment FROM draw_seed WHERE group_id = ?", (group_id,)).fetchone() or (None, None)
+        return {
+            "group_id": group_id,
+            "active": bool(meta.get("active", 0)),
+            "entries": EntryStore((self._entry(r) for r in rows), meta.get("next_number", 1)),
+            "winners": [self._entry(r) for r in winners],
+            "draws": [json.loads(r[0]) for r in draws],
+            "server_seed": seed[0],
+            "commitment": seed[1],
+            "seq": meta.get("seq", 0),
+            "epoch": meta.get("epoch", 0),
+        }
+
+    def _write_meta(self, group_id: int, state: Dict[str, Any]) -> None:
+        self.conn.executemany("INSERT OR REPLACE INTO meta (group_id, key, value) VALUES (?, ?, ?)", [
+            (group_id, "active", int(state["active"])), (group_id, "seq", state["seq"]), (group_id, "next_number", state["entries"].next_number)])
+
+    def _bump_epoch(self, group_id: int, state: Dict[str, Any]) -> None:
+        # The epoch changes on every write that isn't just new entries.
+        self.conn.execute("INSERT INTO meta (group_id, key, value) VALUES (?, 'epoch', 1) ON CONFLICT (group_id, key) DO UPDATE SET value = value + 1", (group_id,))
+        state["epoch"] = self._meta(group_id)["epoch"]
+
+    def _clear(self, group_id: int, tables: List[str]) -> None:
+        for t in tables:
+            self.conn.execute(f"DELETE FROM {t} WHERE group_id = ?", (group_id,))
+
+    def write_ops(self, group_id: int, ops: List[Dict[str, Any]], state: Dict[str, Any]) -> None:
+        c = self.conn
+        g = group_id
+        insert_entries = f"INSERT OR REPLACE INTO entries (group_id, {self.ENTRY_COLUMNS}) VALUES (?,?,?,?,?,?,?)"
+        move_to_winners = f"INSERT INTO winners (group_id, {self.ENTRY_COLUMNS}) SELECT group_id, {self.ENTRY_COLUMNS} FROM entries WHERE group_id = ? AND user_id = ?"
+        with self.transaction():
+            batch = []
+            for op in ops:
+                if op["op"] == "enter":
+                    batch.append(self._row(g, op["entry"]))
+                    continue
+                if batch:
+                    c.executemany(insert_entries, batch)
+                    batch = []
+                if op["op"] == "pick":
+                    c.execute(move_to_winners, (g, op["user_id"]))
+                    c.execute("DELETE FROM entries WHERE group_id = ? AND user_id = ?", (g, op["user_id"]))
+                elif op["op"] == "draw":
+                    user_ids = [(g, w[0]) for w in op["winners"]]
+                    for key in user_ids:
+                        c.execute(move_to_winners, key)
+                    c.executemany("DELETE FROM entries WHERE group_id = ? AND user_id = ?", user_ids)
+                    c.execute("INSERT INTO draws (group_id, record) VALUES (?, ?)", self._draw_row(g, op))
+                elif op["op"] == "commit":
+                    c.execute("INSERT OR REPLACE INTO draw_seed (group_id, server_seed, commitment) VALUES (?, ?, ?)", (g, op["server_seed"], op["commitment"]))
+                elif op["op"] == "weight":
+                    c.execute("UPDATE entries SET weight = ? WHERE group_id = ? AND user_id = ?", (op["weight"], g, op["user_id"]))
+                elif op["op"] == "start":
+                    self._clear(g, ["entries", "winners", "draws", "draw_seed"])
+                elif op["op"] == "clear_winners":
+                    self._clear(g, ["winners"])
+            if batch:
+                c.executemany(insert_entries, batch)
+            self._write_meta(g, state)
+            if any(op["op"] != "enter" for op in ops):
+                self._bump_epoch(g, state)
+
+    def write_snapshot(self, group_id: int, state: Dict[str, Any]) -> None:
+        c = self.conn
+        g = group_id
+        with self.transaction():
+            self._clear(g, ["entries", "winners", "draws", "draw_seed"])
+            c.executemany("INSERT INTO draws (group_id, record) VALUES (?, ?)", (self._draw_row(g, d) for d in state["draws"]))
+            if state.get("commitment"):
+                c.execute("INSERT INTO draw_seed (group_id, server_seed, commitment) VALUES (?, ?, ?)", (g, state["server_seed"], state["commitment"]))
+            c.executemany(f"INSERT INTO entries (group_id, {self.ENTRY_COLUMNS}) VALUES (?,?,?,?,?,?,?)", (self._row(g, e) for e in state["entries"]))
+            c.executemany(f"INSERT INTO winners (group_id, {self.ENTRY_COLUMNS}) VALUES (?,?,?,?,?,?,?)", (self._row(g, e) for e in state["winners"]))
+            self._write_meta(g, state)
+            self._bump_epoch(g, state)
+
+    def load_admin_groups(self) -> dict:
+        return {str(uid): gid for uid, gid in self.conn.execute("SELECT user_id, group_id FROM admin_groups")}
+
+    def save_admin_group(self, user_id: int, group_id: int, groups: dict) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO admin_groups (user_id, group_id) VALUES (?, ?)", (user_id, group_id))
 
-from telegram.constants import ChatMemberStatus
+    def remove_group(self, group_id: int, groups: dict) -> None:
+        self.conn.execute("DELETE FROM admin_groups WHERE group_id = ?", (group_id,))
+
+    def load_announce_settings(self) -> Tuple[dict, Dict[int, dict]]:
+        row = self.conn.execute("SELECT interval, message FROM announce_settings WHERE id = 0").fetchone()
+        defaults = dict(DEFAULT_ANNOUNCE_SETTINGS) if row is None else {"interval": row[0], "message": row[1]}
+        rows = self.conn.execute("SELECT group_id, interval, message FROM group_announce_settings")
+        return defaults, {g: {"interval": i, "message": m} for g, i, m in rows}
+
+    def save_announce_settings(self, group_id: Optional[int], settings: Optional[dict], defaults: dict, groups: Dict[int, dict]) -> None:
+        if group_id is None:
+            self.conn.execute("INSERT OR REPLACE INTO announce_settings (id, interval, message) VALUES (0, ?, ?)", (settings["interval"], settings["message"]))
+        elif settings is None:
+            self.conn.execute("DELETE FROM group_announce_settings WHERE group_id = ?", (group_id,))
+        else:
+            self.conn.execute("INSERT OR REPLACE INTO group_announce_settings (group_id, interval, message) VALUES (?, ?, ?)", (group_id, settings["interval"], settings["message"]))
+
+    def load_custom_buttons(self) -> list:
+        rows = self.conn.execute("SELECT name, url, side_by_side FROM custom_buttons ORDER BY pos")
+        return [{"name": name, "url": url, "side_by_side": bool(side)} for name, url, side in rows]
+
+    def save_custom_buttons(self, buttons: list) -> None:
+        c = self.conn
+        with self.transaction():
+            c.execute("DELETE FROM custom_buttons")
+            c.executemany("INSERT INTO custom_buttons (pos, name, url, side_by_side) VALUES (?, ?, ?, ?)",
+                          [(i, b["name"], b["url"], int(bool(b.get("side_by_side")))) for i, b in enumerate(buttons)])
+
+    def close(self) -> None:
+        self.conn.close()
+
+class SharedSqliteStorage(SqliteStorage):
+    # STORAGE_BACKEND=shared: several bot processes serve one token from one
+    # database. The in-memory state is only a cache. Every mutation runs in
+    # _transaction(), which takes the database write lock and brings the cache
+    # up to date first, so "enter once" and draws see every worker's writes.
+    # While the epoch is unchanged only entries were added, and catching up
+    # reads just those; anything else reloads the giveaway. Admin groups,
+    # announcement settings and custom buttons have an epoch each in
+    # config_epoch, bumped in the same transaction as every write to them.
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.conn.execute(f"PRAGMA busy_timeout = {SHARED_BUSY_TIMEOUT_MS}")
+
+    def sync(self, state: Dict[str, Any]) -> None:
+        # Updates state in place, so references held by callers stay valid.
+        g = state["group_id"]
+        meta = self._meta(g)
+        if meta.get("seq", 0) == state["seq"]:
+            return
+        if meta.get("epoch", 0) != state.get("epoch", 0):
+            state.update(self.load_state(g))
+            return
+        entries = state["entries"]
+        rows = self.conn.execute(f"SELECT {self.ENTRY_COLUMNS} FROM entries WHERE group_id = ? AND number >= ? ORDER BY number", (g, entries.next_number))
+        for r in rows:
+            entries.add(self._entry(r))
+        entries.next_number = meta.get("next_number", entries.next_number)
+        state["seq"] = meta["seq"]
+
+    def config_epoch(self, name: str) -> int:
+        row = self.conn.execute("SELECT value FROM config_epoch WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def _bump_config(self, name: str) -> None:
+        self.conn.execute("INSERT INTO config_epoch (name, value) VALUES (?, 1) ON CONFLICT (name) DO UPDATE SET value = value + 1", (name,))
+
+    def save_admin_group(self, user_id: int, group_id: int, groups: dict) -> None:
+        with self.transaction():
+            super().save_admin_group(user_id, group_id, groups)
+            self._bump_config("admin_groups")
+
+    def remove_group(self, group_id: int, groups: dict) -> None:
+        with self.transaction():
+            super().remove_group(group_id, groups)
+            self._bump_config("admin_groups")
+
+    def save_announce_settings(self, group_id: Optional[int], settings: Optional[dict], defaults: dict, groups: Dict[int, dict]) -> None:
+        with self.transaction():
+            super().save_announce_settings(group_id, settings, defaults, groups)
+            self._bump_config("announce_settings")
+
+    def save_custom_buttons(self, buttons: list) -> None:
+        with self.transaction():
+            super().save_custom_buttons(buttons)
+            self._bump_config("custom_buttons")
+
+def migrate_json_to_sqlite(path: str) -> None:
+    # One-shot copy of the JSON files (snapshot plus journal) into a SQLite database.
+    src, dst = JsonStorage(), SqliteStorage(path)
+    for group_id in src.group_ids():
+        dst.write_snapshot(group_id, src.load_state(group_id))
+    for user_id, group_id in src.load_admin_groups().items():
+        dst.save_admin_group(int(user_id), group_id, None)
+    defaults, groups = src.load_announce_settings()
+    dst.save_announce_settings(None, defaults, defaults, groups)
+    for group_id, settings in groups.items():
+        dst.save_announce_settings(group_id, settings, defaults, groups)
+    dst.save_custom_buttons(src.load_custom_buttons())
+    dst.close()
+    log.info("Migrated JSON state into %s", path)
+
+def _make_storage():
+    if STORAGE_BACKEND == "shared":
+        return SharedSqliteStorage(SQLITE_FILE)
+    if STORAGE_BACKEND == "sqlite":
+        return SqliteStorage(SQLITE_FILE)
+    return JsonStorage()
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()
+SQLITE_FILE = os.getenv("SQLITE_FILE", "giveaway.db")
+SHARED_STATE = STORAGE_BACKEND == "shared"
+# How long a worker waits for another worker's write transaction.
+SHARED_BUSY_TIMEOUT_MS = int(os.getenv("SHARED_BUSY_TIMEOUT_MS", "10000"))
+STORAGE = _make_storage()
+
+# Admin groups, announcement settings and custom buttons are cached per
+# process. With shared state each of those tables has an epoch that every
+# write bumps, and a cache is reread when its epoch has moved.
+_config_epochs: Dict[str, int] = {}
+
+def _config_changed(name: str) -> bool:
+    if not SHARED_STATE:
+        return False
+    epoch = STORAGE.config_epoch(name)
+    if _config_epochs.get(name) == epoch:
+        return False
+    _config_epochs[name] = epoch
+    return True
+
+from telegram.constants import ChatMemberStatus, ChatType
+from telegram.error import Forbidden, NetworkError, RetryAfter, TimedOut
+from telegram.request import HTTPXRequest
+
+class MetricsRequest(HTTPXRequest):
+    # Counts and times every Bot API call by method; errors are failed
+    # requests plus any non-2xx answer.
+    async def do_request(self, url: str, method: str, request_data=None, **kwargs):
+        api = url.rsplit("/", 1)[-1]
+        t0 = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, request_data, **kwargs)
+        except Exception:
+            METRICS.inc("giveaway_api_errors_total", method=api)
+            raise
+        finally:
+            METRICS.observe("giveaway_api_seconds", time.perf_counter() - t0, method=api)
+        if code >= 300:
+            METRICS.inc("giveaway_api_errors_total", method=api)
+        return code, payload
+
+class TTLCache:
+    # LRU-bounded mapping whose items expire ttl seconds after they are set.
+    # Lookups are counted in giveaway_cache_total{cache=name,result}.
+    def __init__(self, ttl: float, maxsize: int, name: str):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.name = name
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            METRICS.inc("giveaway_cache_total", cache=self.name, result="miss")
+            return default
+        self._data.move_to_end(key)
+        METRICS.inc("giveaway_cache_total", cache=self.name, result="hit")
+        return item[1]
+
+    def set(self, key, value) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+ADMIN_CACHE_TTL = float(os.getenv("ADMIN_CACHE_TTL", "300"))
+ADMIN_CACHE_SIZE = int(os.getenv("ADMIN_CACHE_SIZE", "10000"))
+# (chat_id, user_id) -> is admin of that group
+ADMIN_CACHE = TTLCache(ADMIN_CACHE_TTL, ADMIN_CACHE_SIZE, "admins")
+
+async def _cache_chat_admins(bot, chat_id: int) -> Set[int]:
+    # One API call answers the question for every admin of the chat.
+    admins = await bot.get_chat_administrators(chat_id)
+    ids = {m.user.id for m in admins if m.status in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]}
+    for admin_id in ids:
+        ADMIN_CACHE.set((chat_id, admin_id), True)
+    return ids
 
 async def is_admin(user_id: int, update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     chat = update.effective_chat
     if chat and chat.type in ["group", "supergroup"]:
+        cached = ADMIN_CACHE.get((chat.id, user_id))
+        if cached is not None:
+            return cached
         try:
-            admins = await context.bot.get_chat_administrators(chat.id)
-            for member in admins:
-                if member.user.id == user_id:
-                    if member.status in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]:
-                        return True
-            return False
+            found = user_id in await _cache_chat_admins(context.bot, chat.id)
         except Exception as e:
-            print(f"[WARN] Could not fetch chat admins: {e}")
+            log.warning("Could not fetch chat admins: %s", e)
             return user_id in ADMIN_IDS
+        if not found:
+            ADMIN_CACHE.set((chat.id, user_id), False)
+        return found
     # Private chat: check if user is mapped to a group
     groups = _load_admin_groups()
     if str(user_id) in groups:
         return True
     return user_id in ADMIN_IDS
 
+# Resolved once in post_init; refresh_bot_identity() is only called again if
+# that failed.
+BOT_USERNAME: Optional[str] = None
+
+def _set_bot_identity(username: str) -> None:
+    global BOT_USERNAME
+    if username != BOT_USERNAME:
+        for key in [k for k in _KEYBOARDS if k[0] == "dm"]:
+            del _KEYBOARDS[key]
+    BOT_USERNAME = username
+
+async def refresh_bot_identity(bot) -> None:
+    _set_bot_identity((await bot.get_me()).username)
+
+def group_dm_markup(group_id: int) -> InlineKeyboardMarkup:
+    # Deep link, so the /start it opens knows which group's giveaway to show.
+    return _cached_keyboard(("dm", group_id), lambda: InlineKeyboardMarkup([
+        [InlineKeyboardButton("DM the Bot", url=f"https://t.me/{BOT_USERNAME}?start={group_id}")]
+    ]))
+
+async def dm_bot_markup(bot, group_id: int) -> InlineKeyboardMarkup:
+    if BOT_USERNAME is None:
+        await refresh_bot_identity(bot)
+    return group_dm_markup(group_id)
+
+# With several workers on shared state, only one should post announcements.
+# It looks for groups and settings changed on other workers this often.
+RUN_ANNOUNCER = os.getenv("RUN_ANNOUNCER", "1") != "0"
+ANNOUNCE_SYNC_SECONDS = float(os.getenv("ANNOUNCE_SYNC_SECONDS", "30"))
+
+# Startup phases and their durations, logged once post_init is done and
+# shown by /gstats.
+STARTUP_PHASES: List[Tuple[str, float]] = []
+_phase_started = _STARTED
+
+def _startup_phase(name: str) -> None:
+    global _phase_started
+    now = time.perf_counter()
+    STARTUP_PHASES.append((name, now - _phase_started))
+    _phase_started = now
+
+def _adopt_default_giveaway() -> None:
+    # State from before giveaways were per group is giveaway 0. On the first
+    # start after the upgrade, with no group giveaway yet and exactly one
+    # group linked, giveaway 0 moves to that group, so it becomes that group's
+    # own. With several linked groups it stays shared; see _group_giveaway().
+    # Buttons that name giveaway 0 then fall back to the only running giveaway.
+    linked = set(_linked_groups())
+    if len(linked) != 1 or set(STORAGE.group_ids()) - {DEFAULT_GIVEAWAY}:
+        return
+    group_id = linked.pop()
+    state = _load(DEFAULT_GIVEAWAY)
+    _flush()
+    with _transaction(state):
+        if state["seq"] == 0:
+            return
+        del _STATES[DEFAULT_GIVEAWAY]
+        state["group_id"] = group_id
+        _STATES[group_id] = state
+        STORAGE.write_snapshot(group_id, state)
+        _STATES[DEFAULT_GIVEAWAY] = _blank_state()
+        STORAGE.write_snapshot(DEFAULT_GIVEAWAY, _STATES[DEFAULT_GIVEAWAY])
+    log.info("Moved giveaway 0 (%s entries) to the linked group %s", len(state["entries"]), group_id)
+
+def _warm_state() -> List[int]:
+    # Loads every running giveaway so the first update after a restart
+    # doesn't wait for a snapshot to parse. Returns their group ids.
+    _adopt_default_giveaway()
+    groups = sorted(STORAGE.active_groups() | {DEFAULT_GIVEAWAY})
+    for group_id in groups:
+        _load(group_id)
+    return groups
+
+def _warm_caches(groups: List[int]) -> None:
+    # Builds what the first clicks would otherwise build.
+    _load_admin_groups()
+    button_menu_markup(_load_custom_buttons())
+    for active in (False, True):
+        admin_keyboard({"active": active})
+    for group_id in groups:
+        for admin in (False, True):
+            _cached_keyboard(("user", group_id, admin), lambda: _build_user_keyboard(group_id, admin))
+
+# Caching chat admins after a restart runs in the background, at most this
+# many getChatAdministrators calls a second.
+CHAT_ADMINS_WARM_RATE = float(os.getenv("CHAT_ADMINS_WARM_RATE", "10"))
+_warm_chat_admins_task: Optional[asyncio.Task] = None
+
+async def _warm_chat_admins(bot, groups: List[int]) -> None:
+    # One getChatAdministrators per running group, so /giveaway and other
+    # group commands find their answer cached. Updates are served meanwhile;
+    # anything asked before its group is done just makes its own call.
+    bucket = TokenBucket(CHAT_ADMINS_WARM_RATE, CHAT_ADMINS_WARM_RATE)
+    limit = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    async def warm(chat_id):
+        for attempt in range(BROADCAST_MAX_RETRIES + 1):
+            async with limit:
+                await bucket.acquire()
+                try:
+                    await _cache_chat_admins(bot, chat_id)
+                    return
+                except RetryAfter as e:
+                    delay = e.retry_after
+                except Exception as e:
+                    log.warning("Could not fetch admins of %s at startup: %s", chat_id, e)
+                    return
+            await asyncio.sleep(delay.total_seconds() if hasattr(delay, "total_seconds") else delay)
+    started = time.perf_counter()
+    targets = [g for g in groups if g != DEFAULT_GIVEAWAY]
+    await asyncio.gather(*(warm(g) for g in targets))
+    log.info("Cached the admins of %s groups in %.1fs", len(targets), time.perf_counter() - started)
+
+async def _post_init(app: Application) -> None:
+    global ANNOUNCER, _warm_chat_admins_task
+    _startup_phase("initialize")
+    # Application.initialize() has already called getMe; reuse its answer.
+    try:
+        _set_bot_identity(app.bot.username)
+    except Exception as e:
+        log.warning("Could not resolve bot identity at startup: %s", e)
+    groups = _warm_state()
+    _startup_phase("state")
+    _warm_caches(groups)
+    _startup_phase("caches")
+    # Everything loaded so far lives until shutdown; keep the collector from
+    # walking it again on every full collection.
+    gc.freeze()
+    _warm_chat_admins_task = asyncio.create_task(_warm_chat_admins(app.bot, groups))
+    log.info("Started in %.0f ms: %s", sum(t for _, t in STARTUP_PHASES) * 1000,
+             ", ".join(f"{name} {t * 1000:.0f} ms" for name, t in STARTUP_PHASES))
+    if not RUN_ANNOUNCER:
+        return
+    ANNOUNCER = AnnounceScheduler(app.bot)
+    ANNOUNCER.start()
+
+async def _post_stop(app: Application) -> None:
+    if _warm_chat_admins_task is not None and not _warm_chat_admins_task.done():
+        _warm_chat_admins_task.cancel()
+        await asyncio.gather(_warm_chat_admins_task, return_exceptions=True)
+    if ANNOUNCER:
+        await ANNOUNCER.stop()
+    await ELIGIBILITY.stop()
+
+class TokenBucket:
+    # Allows `rate` acquisitions per second with bursts of up to `capacity`.
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+# Telegram allows about 30 messages per second overall and 20 per minute
+# into any one group.
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+BROADCAST_GLOBAL_RATE = float(os.getenv("BROADCAST_GLOBAL_RATE", "30"))
+BROADCAST_CHAT_RATE = float(os.getenv("BROADCAST_CHAT_RATE", str(20 / 60)))
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+_GLOBAL_BUCKET = TokenBucket(BROADCAST_GLOBAL_RATE, BROADCAST_GLOBAL_RATE)
+_CHAT_BUCKETS: Dict[int, TokenBucket] = {}
+
+async def _send_rate_limited(bot, chat_id: int, text: str, reply_markup=None) -> str:
+    # Returns "sent", "failed" or "dropped" (the bot was removed from the chat).
+    bucket = _CHAT_BUCKETS.get(chat_id)
+    if bucket is None:
+        bucket = _CHAT_BUCKETS[chat_id] = TokenBucket(BROADCAST_CHAT_RATE, 3)
+    for attempt in range(BROADCAST_MAX_RETRIES + 1):
+        await bucket.acquire()
+        await _GLOBAL_BUCKET.acquire()
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+            return "sent"
+        except RetryAfter as e:
+            delay = e.retry_after
+            await asyncio.sleep(delay.total_seconds() if hasattr(delay, "total_seconds") else delay)
+        except Forbidden as e:
+            log.warning("Dropping group %s: %s", chat_id, e)
+            _remove_admin_group_chat(chat_id)
+            return "dropped"
+        except (TimedOut, NetworkError) as e:
+            log.warning("Send to %s failed (attempt %s): %s", chat_id, attempt + 1, e)
+            await asyncio.sleep(2 ** attempt)
+        except Exception as e:
+            log.warning("Send to %s failed: %s", chat_id, e)
+            return "failed"
+    return "failed"
+
+async def broadcast(bot, chat_ids, text: str, reply_markup=None) -> Dict[str, Any]:
+    # Fans one message out to many chats with bounded concurrency. A slow or
+    # failing chat only occupies one of the BROADCAST_CONCURRENCY slots.
+    # reply_markup may also be a function of the chat id.
+    started = time.monotonic()
+    sem = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    async def send_one(chat_id):
+        markup = reply_markup(chat_id) if callable(reply_markup) else reply_markup
+        async with sem:
+            return await _send_rate_limited(bot, chat_id, text, markup)
+    results = await asyncio.gather(*(send_one(c) for c in chat_ids))
+    return {
+        "sent": results.count("sent"),
+        "failed": results.count("failed"),
+        "dropped": results.count("dropped"),
+        "duration": time.monotonic() - started,
+    }
+
+class AnnounceScheduler:
+    # Min-heap of (due, group_id). One task sleeps until the earliest due group
+    # and is woken early whenever a new due time is pushed. Superseded heap
+    # items are skipped when they surface.
+    def __init__(self, bot):
+        self.bot = bot
+        self._heap: List[Tuple[float, int]] = []
+        self._due: Dict[int, float] = {}
+        self._wake = asyncio.Event()
+        self._task = None
+        self._sends = set()
+
+    def _push(self, group_id: int, due: float) -> None:
+        self._due[group_id] = due
+        heapq.heappush(self._heap, (due, group_id))
+        self._wake.set()
+
+    def _interval(self, group_id: int) -> float:
+        return _load_announce_settings(group_id)["interval"] * 60
+
+    def _push_spread(self, group_id: int) -> None:
+        # Lands at a random point within the group's interval, so groups
+        # pushed together don't all fire in the same second.
+        self._push(group_id, time.monotonic() + self._interval(group_id) * random.random())
+
+    def ensure(self, group_id: int) -> None:
+        if group_id not in self._due:
+            self._push_spread(group_id)
+
+    def remove(self, group_id: int) -> None:
+        self._due.pop(group_id, None)
+
+    def settings_changed(self, group_id: Optional[int]) -> None:
+        # A changed default only moves groups that don't override it, each to
+        # its own random point so they stay spread out.
+        if group_id is None:
+            overrides = _load_all_announce_settings()[1]
+            for g in [g for g in self._due if g not in overrides]:
+                self._push_spread(g)
+        else:
+            self._push(group_id, time.monotonic() + self._interval(group_id))
+
+    def start(self) -> None:
+        for group_id in _linked_groups():
+            self.ensure(group_id)
+        self._task = asyncio.create_task(self._run())
+
+    def _sync(self) -> None:
+        # With shared state, other workers link and unlink groups and change
+        # settings without this worker's announcer hearing of it.
+        linked = _linked_groups()
+        for group_id in linked:
+            self.ensure(group_id)
+        for group_id in [g for g in self._due if g not in linked]:
+            self.remove(group_id)
+        _load_all_announce_settings()
+
+    async def stop(self) -> None:
+        tasks = [t for t in [self._task, *self._sends] if t]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self) -> None:
+        while True:
+            if SHARED_STATE:
+                self._sync()
+            now = time.monotonic()
+            ready = []
+            while self._heap and self._heap[0][0] <= now:
+                due, group_id = heapq.heappop(self._heap)
+                if self._due.get(group_id) != due:
+                    continue
+                ready.append(group_id)
+                interval = self._interval(group_id)
+                self._push(group_id, due + interval if due + interval > now else now + interval)
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            if ready:
+                task = asyncio.create_task(self._announce(ready))
+                self._sends.add(task)
+                task.add_done_callback(self._sends.discard)
+            timeout = self._heap[0][0] - now if self._heap else None
+            if SHARED_STATE:
+                timeout = ANNOUNCE_SYNC_SECONDS if timeout is None else min(timeout, ANNOUNCE_SYNC_SECONDS)
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _announce(self, group_ids: List[int]) -> None:
+        by_message: Dict[str, List[int]] = {}
+        for group_id in group_ids:
+            if _is_active(_group_giveaway(group_id)):
+                by_message.setdefault(_load_announce_settings(group_id)["message"], []).append(group_id)
+        if not by_message:
+            return
+        try:
+            if BOT_USERNAME is None:
+                await refresh_bot_identity(self.bot)
+            for message, targets in by_message.items():
+                stats = await broadcast(self.bot, targets, message, group_dm_markup)
+                log.info("Announcement sent=%s failed=%s dropped=%s in %.2fs", stats['sent'], stats['failed'], stats['dropped'], stats['duration'])
+        except Exception as e:
+            log.error("Announcement failed: %s", e)
+
+ANNOUNCER: Optional[AnnounceScheduler] = None
+
+# Only members of a giveaway's group can win it: the group itself, or for
+# giveaway 0 any group an admin linked in admin_groups. Entering never waits
+# for a check. Membership is cached for ELIGIBILITY_CACHE_TTL, kept current by
+# chat_member updates (the bot must be a group admin to get them) and checked
+# with getChatMember when the draw menu opens and for drawn winners nobody has
+# checked yet. Anyone whose membership can't be found out counts as eligible.
+REQUIRE_GROUP_MEMBERSHIP = os.getenv("REQUIRE_GROUP_MEMBERSHIP", "1") != "0"
+ELIGIBILITY_CACHE_TTL = float(os.getenv("ELIGIBILITY_CACHE_TTL", "3600"))
+ELIGIBILITY_CACHE_SIZE = int(os.getenv("ELIGIBILITY_CACHE_SIZE", "200000"))
+ELIGIBILITY_CONCURRENCY = int(os.getenv("ELIGIBILITY_CONCURRENCY", "10"))
+ELIGIBILITY_RATE = float(os.getenv("ELIGIBILITY_RATE", "20"))
+ELIGIBILITY_CHUNK = 1000
+ELIGIBILITY_DRAW_ROUNDS = int(os.getenv("ELIGIBILITY_DRAW_ROUNDS", "20"))
+
+def _is_member(member) -> bool:
+    if member.status == ChatMemberStatus.RESTRICTED:
+        return bool(getattr(member, "is_member", False))
+    return member.status in [ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]
+
+class Eligibility:
+    def __init__(self, ttl: float, maxsize: int):
+        self.cache = TTLCache(ttl, maxsize, "eligibility")  # (chat id, user id) -> is member
+        self._limit = asyncio.Semaphore(ELIGIBILITY_CONCURRENCY)
+        self._bucket = TokenBucket(ELIGIBILITY_RATE, ELIGIBILITY_RATE)
+        self._refreshing: Dict[int, asyncio.Task] = {}
+
+    @staticmethod
+    def required_chats(state: Dict[str, Any]) -> List[int]:
+        # Empty when membership isn't checked for this giveaway.
+        if not REQUIRE_GROUP_MEMBERSHIP:
+            return []
+        if state["group_id"] != DEFAULT_GIVEAWAY:
+            return [state["group_id"]]
+        return sorted(_linked_groups())
+
+    def record(self, chat_id: int, user_id: int, is_member: bool) -> None:
+        self.cache.set((chat_id, user_id), is_member)
+
+    def status(self, chats: List[int], user_id: int) -> Optional[bool]:
+        # True if a member of any of the chats, False if known to be in none,
+        # None if that isn't known (or no longer fresh).
+        seen = [self.cache.get((chat_id, user_id)) for chat_id in chats]
+        if True in seen:
+            return True
+        return False if all(v is False for v in seen) else None
+
+    async def verify(self, bot, chats: List[int], user_ids) -> None:
+        # getChatMember for each user, ELIGIBILITY_CONCURRENCY at a time and at
+        # most ELIGIBILITY_RATE per second, stopping at the first chat they're in.
+        async def check(user_id):
+            for chat_id in chats:
+                async with self._limit:
+                    await self._bucket.acquire()
+                    try:
+                        member = await bot.get_chat_member(chat_id, user_id)
+                    except Exception as e:
+                        METRICS.inc("giveaway_eligibility_checks_total", result="error")
+                        log.debug("Could not check %s in %s: %s", user_id, chat_id, e)
+                        continue
+                is_member = _is_member(member)
+                self.record(chat_id, user_id, is_member)
+                METRICS.inc("giveaway_eligibility_checks_total", result="member" if is_member else "non_member")
+                if is_member:
+                    return
+        await asyncio.gather(*(check(u) for u in user_ids))
+
+    def refresh(self, bot, state: Dict[str, Any]) -> None:
+        # Checks the whole pool in the background, at most once at a time per
+        # giveaway, so a draw soon after finds everyone already checked.
+        group_id = state["group_id"]
+        task = self._refreshing.get(group_id)
+        if self.required_chats(state) and (task is None or task.done()):
+            self._refreshing[group_id] = asyncio.create_task(self._refresh(bot, state))
+
+    async def _refresh(self, bot, state: Dict[str, Any]) -> None:
+        chats = self.required_chats(state)
+        user_ids = state["entries"].pool_columns()[1]
+        started = time.perf_counter()
+        try:
+            # In chunks, so neither the cache lookups nor the pending checks
+            # hold the event loop or memory for a whole big pool at once.
+            for i in range(0, len(user_ids), ELIGIBILITY_CHUNK):
+                unknown = [u for u in user_ids[i:i + ELIGIBILITY_CHUNK] if self.status(chats, u) is None]
+                await self.verify(bot, chats, unknown)
+        except Exception as e:
+            log.error("Eligibility refresh of %s failed: %s", state["group_id"], e)
+        log.info("Eligibility of %s entries in %s checked in %.1fs", len(user_ids), state["group_id"], time.perf_counter() - started)
+
+    async def stop(self) -> None:
+        tasks = [t for t in self._refreshing.values() if not t.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+ELIGIBILITY = Eligibility(ELIGIBILITY_CACHE_TTL, ELIGIBILITY_CACHE_SIZE)
+
+async def track_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Promotions, demotions and leaves invalidate the cached admin check;
+    # joins and leaves keep the membership cache current.
+    change = update.chat_member or update.my_chat_member
+    if change:
+        ADMIN_CACHE.pop((change.chat.id, change.new_chat_member.user.id))
+    if update.chat_member:
+        ELIGIBILITY.record(change.chat.id, change.new_chat_member.user.id, _is_member(change.new_chat_member))
+
+# Pre-built keyboards, shared by every message that shows them (PTB markups
+# are immutable). The admin panel only depends on whether the giveaway is
+# running; everything that shows custom buttons is dropped when they change,
+# and the per-group "DM the Bot" links when the bot's username does.
+_KEYBOARDS: Dict[Any, Any] = {}
+
+def _cached_keyboard(key, build: Callable[[], Any]):
+    kb = _KEYBOARDS.get(key)
+    if kb is None:
+        kb = _KEYBOARDS[key] = build()
+    return kb
+
+def _invalidate_button_keyboards() -> None:
+    for key in [k for k in _KEYBOARDS if k[0] in ("user", "custom_rows", "button_menu")]:
+        del _KEYBOARDS[key]
+
 def admin_keyboard(state: Dict[str, Any]) -> InlineKeyboardMarkup:
-    active = state["active"]
+    return _cached_keyboard(("admin", state["active"]), lambda: _build_admin_keyboard(state["active"]))
+
+def _build_admin_keyboard(active: bool) -> InlineKeyboardMarkup:
     buttons = []
     # End/Start Giveaway and Pick Random side by side
     if not active:
@@ -166,6 +2081,9 @@ def admin_keyboard(state: Dict[str, Any]) -> InlineKeyboardMarkup:
             InlineKeyboardButton("End Giveaway ⛔", callback_data="admin:end"),
             InlineKeyboardButton("Pick Random 🎲", callback_data="admin:pick_random")
         ])
+    buttons.append([
+        InlineKeyboardButton("Draw Winners 🎰", callback_data="admin:draw_menu")
+    ])
     # Show Entries and Show Winners side by side
     buttons.append([
         InlineKeyboardButton("Show Entries 📋", callback_data="admin:show_entries"),
@@ -183,13 +2101,25 @@ def admin_keyboard(state: Dict[str, Any]) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(buttons)
 
 async def user_keyboard(state: Dict[str, Any], update: Update, context: ContextTypes.DEFAULT_TYPE) -> InlineKeyboardMarkup:
+    # In private chat is_admin is an in-memory lookup.
+    admin = await is_admin(update.effective_user.id, update, context)
+    group_id = state["group_id"]
+    # Drops the cached keyboards if another worker edited the buttons.
+    _load_custom_buttons()
+    return _cached_keyboard(("user", group_id, admin), lambda: _build_user_keyboard(group_id, admin))
+
+def _build_user_keyboard(group_id: int, admin: bool) -> InlineKeyboardMarkup:
     buttons = []
-    buttons.append([InlineKeyboardButton("🎁 Click to Enter Giveaway", callback_data="user:enter")])
+    buttons.append([InlineKeyboardButton("🎁 Click to Enter Giveaway", callback_data=f"user:enter:{group_id}")])
     buttons.append([InlineKeyboardButton("❓ Help", callback_data="user:help")])
-    user = update.effective_user
-    if await is_admin(user.id, update, context):
+    if admin:
         buttons.append([InlineKeyboardButton("🛠 Admin Panel", callback_data="user:admin")])
     # Add custom buttons after default ones
+    buttons.extend(_cached_keyboard(("custom_rows",), _custom_button_rows))
+    return InlineKeyboardMarkup(buttons)
+
+def _custom_button_rows() -> list:
+    buttons = []
     custom_buttons = _load_custom_buttons()
     i = 0
     while i < len(custom_buttons):
@@ -205,14 +2135,12 @@ async def user_keyboard(state: Dict[str, Any], update: Update, context: ContextT
         else:
             buttons.append([InlineKeyboardButton(btn["name"], url=btn["url"])] )
             i += 1
-    return InlineKeyboardMarkup(buttons)
+    return buttons
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
     if chat and chat.type not in ["group", "supergroup"]:
-        user = update.effective_user
-        async with LOCK:
-            s = _load()
+        s = _load(_entry_group(update, context))
         text = "Welcome! Tap below to enter the current giveaway." 
         kb = await user_keyboard(s, update, context)
         # Always show keyboard, even if inactive
@@ -223,565 +2151,683 @@ async def admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
     if chat and chat.type in ["group", "supergroup"]:
         # Link admin to group
-        groups = _load_admin_groups()
-        already_admin = str(user.id) in groups and groups[str(user.id)] == chat.id
+        async with ADMIN_GROUPS_LOCK:
+            groups = _load_admin_groups()
+            already_admin = str(user.id) in groups and groups[str(user.id)] == chat.id
+            if not already_admin:
+                _save_admin_group(user.id, chat.id)
         if not already_admin:
-            _save_admin_group(user.id, chat.id)
             return await update.message.reply_text("You’ve been added as a giveaway admin for this group!")
         else:
             return await update.message.reply_text("You’re already a giveaway admin for this group!")
     # Private chat: show admin panel
     if not await is_admin(user.id, update, context):
         return await update.message.reply_text("Unauthorized.")
-    async with LOCK:
-        s = _load()
+    s = _load(_giveaway_for(update))
     await update.message.reply_text("Admin Panel", reply_markup=admin_keyboard(s))
 
-async def handle_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    user = query.from_user
-    data = query.data or ""
-    await query.answer()
+def button_menu_markup(custom_buttons: list) -> InlineKeyboardMarkup:
+    # Callers always pass the current _load_custom_buttons() list.
+    return _cached_keyboard(("button_menu",), lambda: _build_button_menu(custom_buttons))
 
-    print(f"[DEBUG] Button pressed. Callback data: {data}")
+def _build_button_menu(custom_buttons: list) -> InlineKeyboardMarkup:
+    menu_buttons = [
+        [InlineKeyboardButton("Add New Button ➕", callback_data="admin:add_button")]
+    ]
+    # List existing buttons for edit/delete/reorder
+    for idx, btn in enumerate(custom_buttons):
+        menu_buttons.append([
+            InlineKeyboardButton(f"Edit: {btn['name']}", callback_data=f"admin:edit_button:{idx}"),
+            InlineKeyboardButton(f"Delete 🗑", callback_data=f"admin:delete_button:{idx}")
+        ])
+    if len(custom_buttons) > 1:
+        menu_buttons.append([
+            InlineKeyboardButton("Reorder Buttons 🔀", callback_data="admin:reorder_buttons")
+        ])
+    menu_buttons.append([
+        InlineKeyboardButton("Back", callback_data="user:admin")
+    ])
+    return InlineKeyboardMarkup(menu_buttons)
 
-    if data == "noop":
-        return
+def edit_button_view(idx: int, btn: dict) -> Tuple[str, InlineKeyboardMarkup]:
+    edit_kb = [
+        [InlineKeyboardButton("Edit Name", callback_data="admin:edit_name")],
+        [InlineKeyboardButton("Edit URL", callback_data="admin:edit_url")],
+        [InlineKeyboardButton("Edit Side-by-Side", callback_data="admin:edit_side_by_side_menu")],
+        [InlineKeyboardButton("Back", callback_data="admin:manage_buttons")]
+    ]
+    text = f"Editing Button #{idx+1}:\nCurrent name: {btn['name']}\nCurrent URL: {btn['url']}\nCurrent side-by-side: {'Yes' if btn.get('side_by_side') else 'No'}"
+    return text, InlineKeyboardMarkup(edit_kb)
 
-    if data == "user:help":
-        help_text = "Help: To become an admin, use /giveaway or /gstart in your group chat as a group admin. Then DM this bot to access admin features."
-        await query.edit_message_text(help_text)
-        return
+# Callback data -> (handler, requires admin, loads state, debounced).
+# Parameterised commands such as admin:delete_button:<i> are registered
+# without their last ":<arg>" segment.
+CALLBACK_ROUTES: Dict[str, Tuple[Callable, bool, bool, bool]] = {}
 
-    if data == "user:admin":
-        async with LOCK:
-            s = _load()
-        await query.edit_message_text("Admin Panel", reply_markup=admin_keyboard(s))
-        return
+def callback_route(*names: str, admin: bool = False, state: bool = True, debounce: bool = False):
+    # With state=False the handler picks its giveaway itself and gets None
+    # instead of the admin's giveaway, which then isn't loaded at all.
+    # debounce=True marks buttons that change something, where a second press
+    # right after the first is a mistake rather than navigation.
+    def register(func):
+        for name in names:
+            CALLBACK_ROUTES[name] = (func, admin, state, debounce)
+        return func
+    return register
 
-    if data.startswith("user:"):
-        async with LOCK:
-            s = _load()
-            if not s["active"]:
-                return await query.edit_message_text("No active giveaway right now.")
-            uid = user.id
-            if any(e["user_id"] == uid for e in s["entries"]):
-                idx = next(i for i,e in enumerate(s["entries"], start=1) if e["user_id"] == uid)
-                return await query.edit_message_text(f"You're already entered. Your number is #{idx}.")
-            entry = {"user_id": uid, "username": user.username or "", "first_name": user.first_name or "", "last_name": user.last_name or ""}
-            s["entries"].append(entry)
-            _save(s)
-            number = len(s["entries"])
-            print(f"[INFO] User entered giveaway: id={uid}, username={user.username}, entry number={number}")
-        await query.edit_message_text(f"You're in! Your entry number is #{number}. Good luck! 🎉")
-        return
+def _resolve_callback(data: str):
+    route = CALLBACK_ROUTES.get(data)
+    if route is not None:
+        return route, None
+    name, sep, arg = data.rpartition(":")
+    if sep and name in CALLBACK_ROUTES:
+        return CALLBACK_ROUTES[name], arg
+    return None, None
 
-    if data.startswith("admin:"):
-        if not await is_admin(user.id, update, context):
-            return await query.edit_message_text("Unauthorized.")
-        cmd = data.split(":",1)[1]
-        print(f"[DEBUG] Admin button command: {cmd}")
-        async with LOCK:
-            s = _load()
-            # Delete Button flow
-            if cmd.startswith("delete_button:"):
-                try:
-                    idx = int(cmd.split(":")[1])
-                    custom_buttons = _load_custom_buttons()
-                    if 0 <= idx < len(custom_buttons):
-                        del custom_buttons[idx]
-                        _save_custom_buttons(custom_buttons)
-                        # Show updated button management UI
-                        menu_buttons = [
-                            [InlineKeyboardButton("Add New Button ➕", callback_data="admin:add_button")]
-                        ]
-                        for i, btn in enumerate(custom_buttons):
-                            menu_buttons.append([
-                                InlineKeyboardButton(f"Edit: {btn['name']}", callback_data=f"admin:edit_button:{i}"),
-                                InlineKeyboardButton(f"Delete 🗑", callback_data=f"admin:delete_button:{i}")
-                            ])
-                        if len(custom_buttons) > 1:
-                            menu_buttons.append([
-                                InlineKeyboardButton("Reorder Buttons 🔀", callback_data="admin:reorder_buttons")
-                            ])
-                        menu_buttons.append([
-                            InlineKeyboardButton("Back", callback_data="user:admin")
-                        ])
-                        await query.edit_message_text("Custom Button Management:", reply_markup=InlineKeyboardMarkup(menu_buttons))
-                        return
-                    else:
-                        await query.edit_message_text("Invalid button index.")
-                        return
-                except Exception as e:
-                    await query.edit_message_text(f"Error deleting button: {e}")
-                    return
-            # Edit Button flow - Step 1: Select button to edit
-            if cmd.startswith("edit_button:"):
-                try:
-                    idx = int(cmd.split(":")[1])
-                    custom_buttons = _load_custom_buttons()
-                    if 0 <= idx < len(custom_buttons):
-                        btn = custom_buttons[idx]
-                        context.user_data["edit_button_idx"] = idx
-                        context.user_data["edit_button_name"] = btn["name"]
-                        context.user_data["edit_button_url"] = btn["url"]
-                        context.user_data["edit_button_side_by_side"] = btn.get("side_by_side", False)
-                        # Show edit options as buttons
-                        edit_kb = [
-                            [InlineKeyboardButton("Edit Name", callback_data="admin:edit_name")],
-                            [InlineKeyboardButton("Edit URL", callback_data="admin:edit_url")],
-                            [InlineKeyboardButton("Edit Side-by-Side", callback_data="admin:edit_side_by_side_menu")],
-                            [InlineKeyboardButton("Back", callback_data="admin:manage_buttons")]
-                        ]
-                        await query.edit_message_text(
-                            f"Editing Button #{idx+1}:\nCurrent name: {btn['name']}\nCurrent URL: {btn['url']}\nCurrent side-by-side: {'Yes' if btn.get('side_by_side') else 'No'}",
-                            reply_markup=InlineKeyboardMarkup(edit_kb)
-                        )
-                        return
-                    else:
-                        await query.edit_message_text("Invalid button index.")
-                        return
-                except Exception as e:
-                    await query.edit_message_text(f"Error editing button: {e}")
-                    return
-            # Edit Button flow - Step 2: Edit Name
-            if cmd == "edit_name":
-                context.user_data["edit_button_step"] = "name"
-                idx = context.user_data.get("edit_button_idx")
-                btn_name = context.user_data.get("edit_button_name", "")
-                await query.edit_message_text(
-                    f"Current name: {btn_name}\nSend the new name for this button:",
-                    reply_markup=None
-                )
-                return
-            # Edit Button flow - Step 3: Edit URL
-            if cmd == "edit_url":
-                context.user_data["edit_button_step"] = "url"
-                idx = context.user_data.get("edit_button_idx")
-                btn_url = context.user_data.get("edit_button_url", "")
-                await query.edit_message_text(
-                    f"Current URL: {btn_url}\nSend the new URL for this button:",
-                    reply_markup=None
-                )
-                return
-            # Edit Button flow - Step 4: Edit Side-by-Side menu
-            if cmd == "edit_side_by_side_menu":
-                context.user_data["edit_button_step"] = None
-                idx = context.user_data.get("edit_button_idx")
-                btn_side = context.user_data.get("edit_button_side_by_side", False)
-                kb = [
-                    [InlineKeyboardButton("Yes", callback_data="admin:edit_side_by_side_true")],
-                    [InlineKeyboardButton("No", callback_data="admin:edit_side_by_side_false")],
-                    [InlineKeyboardButton("Back", callback_data=f"admin:edit_button:{idx}")]
-                ]
-                await query.edit_message_text(
-                    f"Current side-by-side: {'Yes' if btn_side else 'No'}\nShould this button be side by side with the next one?",
-                    reply_markup=InlineKeyboardMarkup(kb)
-                )
-                return
-            # Edit Button flow - Step 5: Save Side-by-Side selection
-            if cmd == "edit_side_by_side_true" or cmd == "edit_side_by_side_false":
-                idx = context.user_data.get("edit_button_idx")
-                name = context.user_data.get("edit_button_name")
-                url = context.user_data.get("edit_button_url")
-                side_by_side = (cmd == "edit_side_by_side_true")
-                if idx is not None and name and url:
-                    custom_buttons = _load_custom_buttons()
-                    if 0 <= idx < len(custom_buttons):
-                        custom_buttons[idx] = {"name": name, "url": url, "side_by_side": side_by_side}
-                        _save_custom_buttons(custom_buttons)
-                        context.user_data["edit_button_side_by_side"] = side_by_side
-                        # Return to edit menu
-                        btn = custom_buttons[idx]
-                        edit_kb = [
-                            [InlineKeyboardButton("Edit Name", callback_data="admin:edit_name")],
-                            [InlineKeyboardButton("Edit URL", callback_data="admin:edit_url")],
-                            [InlineKeyboardButton("Edit Side-by-Side", callback_data="admin:edit_side_by_side_menu")],
-                            [InlineKeyboardButton("Back", callback_data="admin:manage_buttons")]
-                        ]
-                        await query.edit_message_text(
-                            f"Editing Button #{idx+1}:\nCurrent name: {btn['name']}\nCurrent URL: {btn['url']}\nCurrent side-by-side: {'Yes' if btn.get('side_by_side') else 'No'}",
-                            reply_markup=InlineKeyboardMarkup(edit_kb)
-                        )
-                        return
-
-    if data.startswith("user:"):
-        async with LOCK:
-            s = _load()
-            if not s["active"]:
-                return await query.edit_message_text("No active giveaway right now.")
-            uid = user.id
-            if any(e["user_id"] == uid for e in s["entries"]):
-                idx = next(i for i,e in enumerate(s["entries"], start=1) if e["user_id"] == uid)
-                return await query.edit_message_text(f"You're already entered. Your number is #{idx}.")
-            entry = {"user_id": uid, "username": user.username or "", "first_name": user.first_name or "", "last_name": user.last_name or ""}
-            s["entries"].append(entry)
-            _save(s)
-            number = len(s["entries"])
-            print(f"[INFO] User entered giveaway: id={uid}, username={user.username}, entry number={number}")
-        await query.edit_message_text(f"You're in! Your entry number is #{number}. Good luck! 🎉")
-        return
+# Repeated presses of one button by one user are answered with a toast and
+# nothing else while the first press is still being handled, and, for routes
+# registered with debounce=True, for CALLBACK_DEBOUNCE_SECONDS after it was
+# answered. 0 turns off the second part.
+CALLBACK_DEBOUNCE_SECONDS = float(os.getenv("CALLBACK_DEBOUNCE_SECONDS", "1.5"))
+CALLBACK_DEBOUNCE_SIZE = int(os.getenv("CALLBACK_DEBOUNCE_SIZE", "100000"))
 
-    if data.startswith("admin:"):
-        if not await is_admin(user.id, update, context):
-            return await query.edit_message_text("Unauthorized.")
-        cmd = data.split(":",1)[1]
-        print(f"[DEBUG] Admin button command: {cmd}")
-        async with LOCK:
-            s = _load()
-            # Handle Add New Button side_by_side selection
-            if cmd == "add_side_by_side" or cmd == "add_regular":
-                name = context.user_data.get("new_button_name")
-                url = context.user_data.get("new_button_url")
-                side_by_side = (cmd == "add_side_by_side")
-                if name and url:
-                    custom_buttons = _load_custom_buttons()
-                    custom_buttons.append({"name": name, "url": url, "side_by_side": side_by_side})
-                    _save_custom_buttons(custom_buttons)
-                    # Clear context
-                    context.user_data.pop("add_button_step", None)
-                    context.user_data.pop("new_button_name", None)
-                    context.user_data.pop("new_button_url", None)
-                    # Show updated button management UI
-                    menu_buttons = [
-                        [InlineKeyboardButton("Add New Button ➕", callback_data="admin:add_button")]
-                    ]
-                    for idx, btn in enumerate(custom_buttons):
-                        menu_buttons.append([
-                            InlineKeyboardButton(f"Edit: {btn['name']}", callback_data=f"admin:edit_button:{idx}"),
-                            InlineKeyboardButton(f"Delete 🗑", callback_data=f"admin:delete_button:{idx}")
-                        ])
-                    if len(custom_buttons) > 1:
-                        menu_buttons.append([
-                            InlineKeyboardButton("Reorder Buttons 🔀", callback_data="admin:reorder_buttons")
-                        ])
-                    menu_buttons.append([
-                        InlineKeyboardButton("Back", callback_data="user:admin")
-                    ])
-                    await query.edit_message_text("Custom Button Management:", reply_markup=InlineKeyboardMarkup(menu_buttons))
-                    return
+class CallbackDebouncer:
+    # Keyed by (user id, callback data), so different buttons never hold each
+    # other up. Shed presses are counted in giveaway_callbacks_shed_total.
+    def __init__(self, ttl: float, maxsize: int):
+        self.in_flight: Set[Tuple[int, str]] = set()
+        self.recent = TTLCache(ttl, maxsize, "recent_presses")
 
-    if data.startswith("user:"):
-        async with LOCK:
-            s = _load()
-            if not s["active"]:
-                return await query.edit_message_text("No active giveaway right now.")
-            uid = user.id
-            if any(e["user_id"] == uid for e in s["entries"]):
-                idx = next(i for i,e in enumerate(s["entries"], start=1) if e["user_id"] == uid)
-                return await query.edit_message_text(f"You're already entered. Your number is #{idx}.")
-            entry = {"user_id": uid, "username": user.username or "", "first_name": user.first_name or "", "last_name": user.last_name or ""}
-            s["entries"].append(entry)
-            _save(s)
-            number = len(s["entries"])
-            print(f"[INFO] User entered giveaway: id={uid}, username={user.username}, entry number={number}")
-        await query.edit_message_text(f"You're in! Your entry number is #{number}. Good luck! 🎉")
-        return
+    def shed_reason(self, key: Tuple[int, str], debounce: bool) -> Optional[str]:
+        if key in self.in_flight:
+            return "in_flight"
+        if debounce and self.recent.ttl > 0 and self.recent.get(key):
+            return "recent"
+        return None
 
-    if data.startswith("admin:"):
-        if not await is_admin(user.id, update, context):
-            return await query.edit_message_text("Unauthorized.")
-        cmd = data.split(":",1)[1]
-        print(f"[DEBUG] Admin button command: {cmd}")
-        async with LOCK:
-            s = _load()
-            # Add New Button flow
-            if cmd == "add_button":
-                from telegram import ForceReply
-                await query.edit_message_text(
-                    "Send the name for the new button:",
-                    reply_markup=None
-                )
-                # Set context for next message
-                context.user_data["add_button_step"] = "name"
-                return
+    @contextmanager
+    def handling(self, key: Tuple[int, str], debounce: bool):
+        self.in_flight.add(key)
+        try:
+            yield
+        finally:
+            self.in_flight.discard(key)
+            if debounce and self.recent.ttl > 0:
+                self.recent.set(key, True)
 
-    if data.startswith("user:"):
-        async with LOCK:
-            s = _load()
-            if not s["active"]:
-                return await query.edit_message_text("No active giveaway right now.")
-            uid = user.id
-            if any(e["user_id"] == uid for e in s["entries"]):
-                idx = next(i for i,e in enumerate(s["entries"], start=1) if e["user_id"] == uid)
-                return await query.edit_message_text(f"You're already entered. Your number is #{idx}.")
-            entry = {"user_id": uid, "username": user.username or "", "first_name": user.first_name or "", "last_name": user.last_name or ""}
-            s["entries"].append(entry)
-            _save(s)
-            number = len(s["entries"])
-            print(f"[INFO] User entered giveaway: id={uid}, username={user.username}, entry number={number}")
-        await query.edit_message_text(f"You're in! Your entry number is #{number}. Good luck! 🎉")
-        return
+CALLBACK_DEBOUNCER = CallbackDebouncer(CALLBACK_DEBOUNCE_SECONDS, CALLBACK_DEBOUNCE_SIZE)
+SHED_TOASTS = {"in_flight": "Working on it…", "recent": "Already done, no need to tap again."}
 
-    if data.startswith("admin:"):
-        if not await is_admin(user.id, update, context):
+async def handle_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    data = query.data or ""
+    key = (query.from_user.id, data)
+    route, arg = _resolve_callback(data)
+    debounce = route is not None and route[3]
+    reason = CALLBACK_DEBOUNCER.shed_reason(key, debounce)
+    if reason is not None:
+        METRICS.inc("giveaway_callbacks_shed_total", reason=reason)
+        return await query.answer(SHED_TOASTS[reason])
+    with CALLBACK_DEBOUNCER.handling(key, debounce), _handler_metrics(route[0].__name__.lstrip("_") if route else "unknown_callback"):
+        await query.answer()
+        log.debug("Button pressed. Callback data: %s", data)
+        if route is None:
+            log.debug("Unknown action for callback data: %s", data)
+            return await query.edit_message_text("Unknown action.")
+        func, needs_admin, needs_state, _ = route
+        if needs_admin and not await is_admin(query.from_user.id, update, context):
             return await query.edit_message_text("Unauthorized.")
-        cmd = data.split(":",1)[1]
-        print(f"[DEBUG] Admin button command: {cmd}")
-        async with LOCK:
-            s = _load()
-            if cmd == "manage_buttons":
-                custom_buttons = _load_custom_buttons()
-                menu_buttons = [
-                    [InlineKeyboardButton("Add New Button ➕", callback_data="admin:add_button")]
-                ]
-                # List existing buttons for edit/delete/reorder
-                for idx, btn in enumerate(custom_buttons):
-                    menu_buttons.append([
-                        InlineKeyboardButton(f"Edit: {btn['name']}", callback_data=f"admin:edit_button:{idx}"),
-                        InlineKeyboardButton(f"Delete 🗑", callback_data=f"admin:delete_button:{idx}")
-                    ])
-                if len(custom_buttons) > 1:
-                    menu_buttons.append([
-                        InlineKeyboardButton("Reorder Buttons 🔀", callback_data="admin:reorder_buttons")
-                    ])
-                menu_buttons.append([
-                    InlineKeyboardButton("Back", callback_data="user:admin")
-                ])
-                await query.edit_message_text("Custom Button Management:", reply_markup=InlineKeyboardMarkup(menu_buttons))
-                return
+        await func(update, context, _load(_giveaway_for(update)) if needs_state else None, arg)
+
+@callback_route("noop", state=False)
+async def _cb_noop(update, context, s, arg):
+    return
+
+@callback_route("user:help", state=False)
+async def _cb_help(update, context, s, arg):
+    help_text = "Help: To become an admin, use /giveaway or /gstart in your group chat as a group admin. Then DM this bot to access admin features."
+    await update.callback_query.edit_message_text(help_text)
+
+@callback_route("user:enter", state=False, debounce=True)
+async def _cb_enter(update, context, s, arg):
+    query = update.callback_query
     user = query.from_user
-    data = query.data or ""
-    await query.answer()
+    # Keyboards sent before giveaways were per group carry no group id.
+    group_id = _known_group(arg)
+    if group_id is None:
+        group_id = _entry_group(update, context)
+    number, created = await ENTRY_BATCHER.submit(user, group_id)
+    if number is None:
+        return await query.edit_message_text("No active giveaway right now.")
+    if not created:
+        return await query.edit_message_text(f"You're already entered. Your number is #{number}.")
+    log.info("User entered giveaway: id=%s, username=%s, entry number=%s", user.id, user.username, number)
+    await query.edit_message_text(f"You're in! Your entry number is #{number}. Good luck! 🎉")
 
-    print(f"[DEBUG] Button pressed. Callback data: {data}")
+@callback_route("user:admin", "admin:cancel_end", "admin:cancel_reset_announce", admin=True)
+async def _cb_admin_panel(update, context, s, arg):
+    text = {
+        "admin:cancel_end": "End giveaway cancelled.",
+        "admin:cancel_reset_announce": "Reset announcement cancelled.",
+    }.get(update.callback_query.data, "Admin Panel")
+    await update.callback_query.edit_message_text(text, reply_markup=admin_keyboard(s))
 
-    if data == "noop":
-        return
+@callback_route("admin:show_entries")
+async def _cb_show_entries(update, context, s, arg):
+    # show_entries/show_winners do their own admin check.
+    await show_entries(update, context)
 
-    if data == "user:help":
-        help_text = "Help: To become an admin, use /giveaway or /gstart in your group chat as a group admin. Then DM this bot to access admin features."
-        await query.edit_message_text(help_text)
-        return
+@callback_route("admin:show_winners")
+async def _cb_show_winners(update, context, s, arg):
+    await show_winners(update, context)
 
-    if data == "user:admin":
-        async with LOCK:
-            s = _load()
-        await query.edit_message_text("Admin Panel", reply_markup=admin_keyboard(s))
-        return
+@callback_route("admin:entries_page", "admin:winners_page", admin=True)
+async def _cb_list_page(update, context, s, arg):
+    kind = "entries" if update.callback_query.data.startswith("admin:entries_page") else "winners"
+    text, kb = _list_page_view(kind, s, int(arg))
+    await update.callback_query.edit_message_text(text, reply_markup=kb)
 
-    if data.startswith("user:"):
-        async with LOCK:
-            s = _load()
-            if not s["active"]:
-                return await query.edit_message_text("No active giveaway right now.")
-            uid = user.id
-            if any(e["user_id"] == uid for e in s["entries"]):
-                idx = next(i for i,e in enumerate(s["entries"], start=1) if e["user_id"] == uid)
-                return await query.edit_message_text(f"You're already entered. Your number is #{idx}.")
-            entry = {"user_id": uid, "username": user.username or "", "first_name": user.first_name or "", "last_name": user.last_name or ""}
-            s["entries"].append(entry)
-            _save(s)
-            number = len(s["entries"])
-            print(f"[INFO] User entered giveaway: id={uid}, username={user.username}, entry number={number}")
-        await query.edit_message_text(f"You're in! Your entry number is #{number}. Good luck! 🎉")
-        return
+@callback_route("admin:export_entries", "admin:export_winners", admin=True)
+async def _cb_export(update, context, s, arg):
+    kind = "entries" if update.callback_query.data.startswith("admin:export_entries") else "winners"
+    await export_list(kind, "jsonl" if arg == "jsonl" else "csv", update, context)
 
-    if data.startswith("admin:"):
-        if not await is_admin(user.id, update, context):
-            return await query.edit_message_text("Unauthorized.")
-        cmd = data.split(":",1)[1]
-        print(f"[DEBUG] Admin button command: {cmd}")
-        async with LOCK:
-            s = _load()
-            if cmd == "show_entries":
-                return await show_entries(update, context)
-            if cmd == "show_winners":
-                return await show_winners(update, context)
-            if cmd == "start":
-                s["active"] = True
-                s["entries"] = []
-                s["winners"] = []
-                _save(s)
-                print("[INFO] Giveaway started. Entries and winners cleared.")
-                # If in private chat, announce to associated group
-                if update.effective_chat.type == "private":
-                    groups = _load_admin_groups()
-                    group_id = groups.get(str(user.id))
-                    if group_id:
-                        bot_username = (await context.bot.get_me()).username
-                        await context.bot.send_message(
-                            chat_id=group_id,
-                            text="A giveaway has started! Use /start in private chat with the bot to enter.",
-                            reply_markup=InlineKeyboardMarkup([
-                                [InlineKeyboardButton("DM the Bot", url=f"https://t.me/{bot_username}")]
-                            ])
-                        )
-                return await query.edit_message_text("Giveaway started. Entries cleared.", reply_markup=admin_keyboard(s))
-            if cmd == "end":
-                # Show confirmation keyboard
-                confirm_kb = InlineKeyboardMarkup([
-                    [
-                        InlineKeyboardButton("Yes", callback_data="admin:confirm_end"),
-                        InlineKeyboardButton("No", callback_data="admin:cancel_end")
-                    ]
-                ])
-                return await query.edit_message_text("Are you sure you want to end the giveaway?", reply_markup=confirm_kb)
-            if cmd == "pick_random":
-                if not s["entries"]:
-                    return await query.edit_message_text("No entries to pick from.", reply_markup=admin_keyboard(s))
-                winner = random.choice(s["entries"])
-                s["entries"] = [e for e in s["entries"] if e["user_id"] != winner["user_id"]]
-                s["winners"].append(winner)
-                _save(s)
-                ulabel = winner.get("username") and f"@{winner['username']}" or f"{winner.get('first_name','')} {winner.get('last_name','')}".strip()
-                print(f"[INFO] Random winner picked: {ulabel} (id {winner['user_id']})")
-                # Send winner announcement to group if in private chat
-                if update.effective_chat.type == "private":
-                    groups = _load_admin_groups()
-                    group_id = groups.get(str(user.id))
-                    if group_id:
-                        bot_username = (await context.bot.get_me()).username
-                        await context.bot.send_message(
-                            chat_id=group_id,
-                            text=f"🎉 Giveaway Winner: {ulabel} (id {winner['user_id']})",
-                            reply_markup=InlineKeyboardMarkup([
-                                [InlineKeyboardButton("DM the Bot", url=f"https://t.me/{bot_username}")]
-                            ])
-                        )
-                return await query.edit_message_text(f"Winner: {ulabel} (id {winner['user_id']}) 🏆\nRemoved from current pool.", reply_markup=admin_keyboard(s))
-            if cmd == "clear_winners":
-                s["winners"] = []
-                _save(s)
-                print("[INFO] Winners list cleared.")
-                return await query.edit_message_text("Winners list cleared.", reply_markup=admin_keyboard(s))
-            if cmd == "set_announce_interval":
-                print("[DEBUG] Set Announcement Interval button pressed.")
-                # Show instructions to admin in private chat
-                if update.effective_chat.type == "private":
-                    await query.edit_message_text(
-                        "To set the announcement interval, use:\n/gset_announce_settings <minutes> <message>\nExample: /gset_announce_settings 15 Giveaway is live! DM the bot to enter.",
-                        reply_markup=admin_keyboard(s)
-                    )
-                else:
-                    await query.edit_message_text("Please DM the bot to set the announcement interval.", reply_markup=admin_keyboard(s))
-                return
-            if cmd == "reset_announce":
-                # Show confirmation keyboard
-                confirm_kb = InlineKeyboardMarkup([
-                    [
-                        InlineKeyboardButton("Yes", callback_data="admin:confirm_reset_announce"),
-                        InlineKeyboardButton("No", callback_data="admin:cancel_reset_announce")
-                    ]
-                ])
-                return await query.edit_message_text("Are you sure you want to reset announcement settings?", reply_markup=confirm_kb)
-            if cmd == "confirm_end":
-                s["active"] = False
-                _save(s)
-                print("[INFO] Giveaway ended.")
-                return await query.edit_message_text("Giveaway ended.", reply_markup=admin_keyboard(s))
-            if cmd == "cancel_end":
-                return await query.edit_message_text("End giveaway cancelled.", reply_markup=admin_keyboard(s))
-            if cmd == "confirm_reset_announce":
-                _save_announce_settings(15, "A giveaway is active! DM this bot and use /start to enter.")
-                print("[INFO] Announcement settings reset to default.")
-                return await query.edit_message_text("Announcement settings reset to default.", reply_markup=admin_keyboard(s))
-            if cmd == "cancel_reset_announce":
-                return await query.edit_message_text("Reset announcement cancelled.", reply_markup=admin_keyboard(s))
-    # Fallback
-    print(f"[DEBUG] Unknown action for callback data: {data}")
-    await query.edit_message_text("Unknown action.")
-
-async def show_entries(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    
-    query = getattr(update, "callback_query", None)
+@callback_route("admin:manage_buttons", admin=True)
+async def _cb_manage_buttons(update, context, s, arg):
+    await update.callback_query.edit_message_text("Custom Button Management:", reply_markup=button_menu_markup(_load_custom_buttons()))
+
+@callback_route("admin:add_button", admin=True)
+async def _cb_add_button(update, context, s, arg):
+    await update.callback_query.edit_message_text(
+        "Send the name for the new button:",
+        reply_markup=None
+    )
+    # Set context for next message
+    context.user_data["add_button_step"] = "name"
+
+@callback_route("admin:add_side_by_side", "admin:add_regular", admin=True)
+async def _cb_add_button_done(update, context, s, arg):
+    query = update.callback_query
+    name = context.user_data.get("new_button_name")
+    url = context.user_data.get("new_button_url")
+    side_by_side = (query.data == "admin:add_side_by_side")
+    if not (name and url):
+        return await query.edit_message_text("Nothing to add. Start again from Manage Custom Buttons.")
+    async with BUTTONS_LOCK:
+        custom_buttons = _load_custom_buttons()
+        custom_buttons.append({"name": name, "url": url, "side_by_side": side_by_side})
+        _save_custom_buttons(custom_buttons)
+    # Clear context
+    context.user_data.pop("add_button_step", None)
+    context.user_data.pop("new_button_name", None)
+    context.user_data.pop("new_button_url", None)
+    await query.edit_message_text("Custom Button Management:", reply_markup=button_menu_markup(custom_buttons))
+
+@callback_route("admin:delete_button", admin=True, debounce=True)
+async def _cb_delete_button(update, context, s, arg):
+    query = update.callback_query
     try:
-        print("[DEBUG] show_entries: is_admin check")
-        if not await is_admin(update.effective_user.id, update, context):
-            print("[DEBUG] show_entries: not admin")
-            if query:
-                return await query.edit_message_text("Unauthorized.")
-            return await update.message.reply_text("Unauthorized.")
-        print("[DEBUG] show_entries: acquiring lock...")
-        print("[DEBUG] show_entries: lock acquired")
-        s = _load()
-        print(f"[DEBUG] show_entries: loaded state: {s}")
-        entries = s.get("entries", None)
-        print(f"[DEBUG] show_entries: entries: {entries}")
-        if not isinstance(entries, list):
-            print(f"[ERROR] show_entries: entries is not a list: {entries}")
-            if query:
-                return await query.edit_message_text("Entries data error.")
-            return await update.message.reply_text("Entries data error.")
-        if not entries:
-            print("[DEBUG] show_entries: no entries")
-            if query:
-                return await query.edit_message_text("Entries: (none)")
-            return await update.message.reply_text("Entries: (none)")
-        print("[DEBUG] show_entries: formatting entries")
-        lines = []
-        for i, e in enumerate(entries, start=1):
-            tag = f"@{e.get('username','')}" if e.get("username") else f"{e.get('first_name','')} {e.get('last_name','')}".strip()
-            lines.append(f"#{i} - {tag} (id {e.get('user_id','?')})")
-        print(f"[DEBUG] show_entries: lines: {lines}")
-        if query:
-            await query.edit_message_text("Entries:\n" + "\n".join(lines))
-        else:
-            await update.message.reply_text("Entries:\n" + "\n".join(lines))
+        idx = int(arg)
+        async with BUTTONS_LOCK:
+            custom_buttons = _load_custom_buttons()
+            valid = 0 <= idx < len(custom_buttons)
+            if valid:
+                del custom_buttons[idx]
+                _save_custom_buttons(custom_buttons)
+        if not valid:
+            return await query.edit_message_text("Invalid button index.")
+        await query.edit_message_text("Custom Button Management:", reply_markup=button_menu_markup(custom_buttons))
     except Exception as e:
-        print(f"[ERROR] show_entries failed: {e}")
-        if query:
-            await query.edit_message_text("Error displaying entries.")
-        else:
-            await update.message.reply_text("Error displaying entries.")
+        await query.edit_message_text(f"Error deleting button: {e}")
+
+@callback_route("admin:edit_button", admin=True)
+async def _cb_edit_button(update, context, s, arg):
+    # Edit Button flow - Step 1: Select button to edit
+    query = update.callback_query
+    try:
+        idx = int(arg)
+        custom_buttons = _load_custom_buttons()
+        if not 0 <= idx < len(custom_buttons):
+            return await query.edit_message_text("Invalid button index.")
+        btn = custom_buttons[idx]
+        context.user_data["edit_button_idx"] = idx
+        context.user_data["edit_button_name"] = btn["name"]
+        context.user_data["edit_button_url"] = btn["url"]
+        context.user_data["edit_button_side_by_side"] = btn.get("side_by_side", False)
+        text, kb = edit_button_view(idx, btn)
+        await query.edit_message_text(text, reply_markup=kb)
+    except Exception as e:
+        await query.edit_message_text(f"Error editing button: {e}")
+
+@callback_route("admin:edit_name", "admin:edit_url", admin=True)
+async def _cb_edit_field(update, context, s, arg):
+    # Edit Button flow - Steps 2/3: ask for the new name or URL
+    query = update.callback_query
+    if query.data == "admin:edit_name":
+        context.user_data["edit_button_step"] = "name"
+        prompt = f"Current name: {context.user_data.get('edit_button_name', '')}\nSend the new name for this button:"
+    else:
+        context.user_data["edit_button_step"] = "url"
+        prompt = f"Current URL: {context.user_data.get('edit_button_url', '')}\nSend the new URL for this button:"
+    await query.edit_message_text(prompt, reply_markup=None)
+
+@callback_route("admin:edit_side_by_side_menu", admin=True)
+async def _cb_edit_side_by_side_menu(update, context, s, arg):
+    # Edit Button flow - Step 4: Edit Side-by-Side menu
+    context.user_data["edit_button_step"] = None
+    idx = context.user_data.get("edit_button_idx")
+    btn_side = context.user_data.get("edit_button_side_by_side", False)
+    kb = [
+        [InlineKeyboardButton("Yes", callback_data="admin:edit_side_by_side_true")],
+        [InlineKeyboardButton("No", callback_data="admin:edit_side_by_side_false")],
+        [InlineKeyboardButton("Back", callback_data=f"admin:edit_button:{idx}")]
+    ]
+    await update.callback_query.edit_message_text(
+        f"Current side-by-side: {'Yes' if btn_side else 'No'}\nShould this button be side by side with the next one?",
+        reply_markup=InlineKeyboardMarkup(kb)
+    )
+
+@callback_route("admin:edit_side_by_side_true", "admin:edit_side_by_side_false", admin=True)
+async def _cb_edit_side_by_side(update, context, s, arg):
+    # Edit Button flow - Step 5: Save Side-by-Side selection
+    query = update.callback_query
+    idx = context.user_data.get("edit_button_idx")
+    name = context.user_data.get("edit_button_name")
+    url = context.user_data.get("edit_button_url")
+    side_by_side = (query.data == "admin:edit_side_by_side_true")
+    async with BUTTONS_LOCK:
+        custom_buttons = _load_custom_buttons()
+        valid = idx is not None and name and url and 0 <= idx < len(custom_buttons)
+        if valid:
+            custom_buttons[idx] = {"name": name, "url": url, "side_by_side": side_by_side}
+            _save_custom_buttons(custom_buttons)
+    if not valid:
+        return await query.edit_message_text("Invalid button index.")
+    context.user_data["edit_button_side_by_side"] = side_by_side
+    # Return to edit menu
+    text, kb = edit_button_view(idx, custom_buttons[idx])
+    await query.edit_message_text(text, reply_markup=kb)
+
+@callback_route("admin:start", admin=True, debounce=True)
+async def _cb_start(update, context, s, arg):
+    async with ENTRIES_LOCK, WINNERS_LOCK:
+        with _transaction(s):
+            # Start on an old panel can replace a running giveaway; its seed
+            # is published once the new one has taken its place.
+            previous = {"commitment": s.get("commitment"), "server_seed": s.get("server_seed")}
+            _commit(s, {"op": "start"})
+            _commit_seed(s)
+        _reveal_seed(previous)
+    log.info("Giveaway started. Entries and winners cleared. Draw commitment %s", s['commitment'])
+    # If in private chat, announce to associated group
+    if update.effective_chat.type == "private":
+        group_id = s["group_id"]
+        if group_id:
+            await context.bot.send_message(
+                chat_id=group_id,
+                text=f"A giveaway has started! Use /start in private chat with the bot to enter.\nDraw commitment (SHA-256): {s['commitment']}",
+                reply_markup=await dm_bot_markup(context.bot, group_id)
+            )
+    await update.callback_query.edit_message_text("Giveaway started. Entries cleared.", reply_markup=admin_keyboard(s))
+
+# Confirmation keyboards
+_CONFIRM_END_KB = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Yes", callback_data="admin:confirm_end"),
+        InlineKeyboardButton("No", callback_data="admin:cancel_end")
+    ]
+])
+_CONFIRM_RESET_KB = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Yes", callback_data="admin:confirm_reset_announce"),
+        InlineKeyboardButton("No", callback_data="admin:cancel_reset_announce")
+    ]
+])
+
+@callback_route("admin:end", admin=True)
+async def _cb_end(update, context, s, arg):
+    await update.callback_query.edit_message_text("Are you sure you want to end the giveaway?", reply_markup=_CONFIRM_END_KB)
+
+@callback_route("admin:confirm_end", admin=True, debounce=True)
+async def _cb_confirm_end(update, context, s, arg):
+    async with ENTRIES_LOCK:
+        with _transaction(s):
+            was_active = s["active"]
+            _commit(s, {"op": "end"})
+        if was_active:
+            _reveal_seed(s)
+    log.info("Giveaway ended.")
+    text = "Giveaway ended."
+    if s.get("server_seed"):
+        text += f"\nDraw seed revealed: {s['server_seed']}\nCheck it with: python giveaway_bot.py verify-draws {DRAW_AUDIT_FILE} {s['group_id']}"
+    await update.callback_query.edit_message_text(text, reply_markup=admin_keyboard(s))
+
+async def _draw_eligible(bot, state: Dict[str, Any], k: int) -> Optional[Dict[str, Any]]:
+    # Takes ENTRIES_LOCK and WINNERS_LOCK for each attempt, never across a
+    # membership check. Known non-members are passed over. If a draw picks
+    # winners nobody has checked yet, it is dropped, they are checked with the
+    # locks released, and the draw is tried again. After ELIGIBILITY_DRAW_ROUNDS
+    # attempts anyone still unchecked counts as eligible. Entries made in the
+    # meantime are left out, so they don't reshuffle the draw order.
+    chats = ELIGIBILITY.required_chats(state)
+    if not chats:
+        async with ENTRIES_LOCK, WINNERS_LOCK:
+            return _commit_draw(state, k)
+    next_number = state["entries"].next_number
+    checked: Set[int] = set()
+    excluded = lambda user_id: ELIGIBILITY.status(chats, user_id) is False
+    unchecked = lambda user_id: user_id not in checked and ELIGIBILITY.status(chats, user_id) is None
+    for attempt in range(1, ELIGIBILITY_DRAW_ROUNDS + 1):
+        async with ENTRIES_LOCK, WINNERS_LOCK:
+            op = _commit_draw(state, k, excluded, unchecked if attempt < ELIGIBILITY_DRAW_ROUNDS else None, next_number)
+        if op is None or "unchecked" not in op:
+            return op
+        checked.update(op["unchecked"])
+        await ELIGIBILITY.verify(bot, chats, op["unchecked"])
+
+@callback_route("admin:pick_random", admin=True, debounce=True)
+async def _cb_pick_random(update, context, s, arg):
+    query = update.callback_query
+    winner = s["winners"][-1] if await _draw_eligible(context.bot, s, 1) else None
+    if winner is None:
+        return await query.edit_message_text("No entries to pick from.", reply_markup=admin_keyboard(s))
+    ulabel = winner.get("username") and f"@{winner['username']}" or f"{winner.get('first_name','')} {winner.get('last_name','')}".strip()
+    log.info("Random winner picked: %s (id %s)", ulabel, winner['user_id'])
+    # Send winner announcement to group if in private chat
+    if update.effective_chat.type == "private":
+        group_id = s["group_id"]
+        if group_id:
+            await context.bot.send_message(
+                chat_id=group_id,
+                text=f"🎉 Giveaway Winner: {ulabel} (id {winner['user_id']})",
+                reply_markup=await dm_bot_markup(context.bot, group_id)
+            )
+    await query.edit_message_text(f"Winner: {ulabel} (id {winner['user_id']}) 🏆\nRemoved from current pool.", reply_markup=admin_keyboard(s))
+
+DRAW_PRESETS = [1, 3, 5, 10, 25, 100]
+_presets = [InlineKeyboardButton(str(k), callback_data=f"admin:draw:{k}") for k in DRAW_PRESETS]
+_DRAW_MENU_KB = InlineKeyboardMarkup([_presets[:3], _presets[3:], [InlineKeyboardButton("Back", callback_data="user:admin")]])
+
+def _winners_text(title: str, winners: List[Dict[str, Any]]) -> str:
+    # One message for the whole draw, cut short to fit Telegram's 4096 limit.
+    text = title
+    for i, e in enumerate(winners, start=1):
+        line = f"\n{i}. {_entry_label(e)} (id {e['user_id']})"
+        if len(text) + len(line) > 4000:
+            return text + f"\n…and {len(winners) - i + 1} more"
+        text += line
+    return text
+
+async def run_draw(update: Update, context: ContextTypes.DEFAULT_TYPE, k: int) -> str:
+    # Draws k winners with a single journal record and announces them to the
+    # admin's group in one message. Returns the summary for the admin.
+    s = _load(_giveaway_for(update))
+    op = await _draw_eligible(context.bot, s, k)
+    winners = s["winners"][-len(op["winners"]):] if op else []
+    if not winners:
+        return "No eligible entries to draw from."
+    pool_size = op["pool_size"]
+    log.info("Draw %s: %s of %s requested winners from %s entries, %s passed over as not in the group", op['draw'], len(winners), k, pool_size, len(op.get("excluded", ())))
+    if update.effective_chat.type == "private":
+        group_id = s["group_id"]
+        if group_id:
+            await context.bot.send_message(
+                chat_id=group_id,
+                text=_winners_text(f"🎉 Giveaway Winners ({len(winners)}):", winners),
+                reply_markup=await dm_bot_markup(context.bot, group_id)
+            )
+    return _winners_text(f"Draw #{op['draw']}: {len(winners)} winners from {pool_size} entries 🏆", winners)
+
+@callback_route("admin:draw_menu", admin=True)
+async def _cb_draw_menu(update, context, s, arg):
+    # A draw usually follows; check the pool's membership meanwhile.
+    ELIGIBILITY.refresh(context.bot, s)
+    await update.callback_query.edit_message_text(
+        f"How many winners? ({len(s['entries'])} entries)\nFor any other number use /gdraw <count>.",
+        reply_markup=_DRAW_MENU_KB
+    )
+
+@callback_route("admin:draw", admin=True, debounce=True)
+async def _cb_draw(update, context, s, arg):
+    text = await run_draw(update, context, int(arg))
+    await update.callback_query.edit_message_text(text, reply_markup=admin_keyboard(s))
+
+async def draw_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_admin(update.effective_user.id, update, context):
+        return await update.message.reply_text("Unauthorized.")
+    args = context.args
+    if not args or not args[0].isdigit() or int(args[0]) < 1:
+        return await update.message.reply_text("Usage: /gdraw <count>")
+    text = await run_draw(update, context, int(args[0]))
+    await update.message.reply_text(text)
+
+def _stats_text() -> str:
+    # Latencies are bucket upper bounds, in ms.
+    sections = [
+        ("giveaway_handler_seconds", "Handlers", "giveaway_handler_errors_total"),
+        ("giveaway_lock_wait_seconds", "Lock wait", None),
+        ("giveaway_storage_seconds", "Storage", None),
+        ("giveaway_api_seconds", "Telegram API", "giveaway_api_errors_total"),
+    ]
+    lines = []
+    for name, title, errors_name in sections:
+        rows = sorted((labels, h) for (n, labels), h in METRICS.histograms.items() if n == name)
+        if rows:
+            lines.append(f"{title} (count, p50, p99):")
+        for labels, h in rows:
+            line = f"  {','.join(str(v) for _, v in labels)}: {sum(h[:-1])}, {METRICS.quantile(h, 0.5) * 1000:g} ms, {METRICS.quantile(h, 0.99) * 1000:g} ms"
+            errors = METRICS.counters.get((errors_name, labels))
+            if errors:
+                line += f", {errors:g} errors"
+            lines.append(line)
+    if STARTUP_PHASES:
+        lines.append("Startup: " + ", ".join(f"{name} {t * 1000:.0f} ms" for name, t in STARTUP_PHASES))
+    caches: Dict[str, Dict[str, float]] = {}
+    for (name, labels), n in METRICS.counters.items():
+        if name == "giveaway_cache_total":
+            caches.setdefault(dict(labels)["cache"], {})[dict(labels)["result"]] = n
+    if caches:
+        lines.append("Cache hits: " + ", ".join(
+            f"{cache} {c.get('hit', 0):g}/{c.get('hit', 0) + c.get('miss', 0):g}" for cache, c in sorted(caches.items())))
+    shed = sorted((labels[0][1], n) for (name, labels), n in METRICS.counters.items() if name == "giveaway_callbacks_shed_total")
+    if shed:
+        lines.append("Repeated presses shed: " + ", ".join(f"{reason} {n:g}" for reason, n in shed))
+    return "\n".join(lines) or "No metrics recorded yet."
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_admin(update.effective_user.id, update, context):
+        return await update.message.reply_text("Unauthorized.")
+    await update.message.reply_text(_stats_text()[:4096])
+
+MAX_ENTRY_WEIGHT = 2**31
+
+async def set_entry_weight(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Bonus entries: an entry with weight 3 is three times as likely to be drawn.
+    if not await is_admin(update.effective_user.id, update, context):
+        return await update.message.reply_text("Unauthorized.")
+    args = context.args
+    # Weights are summed in array('q'), so they are capped well below its range.
+    if len(args) != 2 or not args[0].isdecimal() or not args[1].isdecimal() or int(args[1]) >= MAX_ENTRY_WEIGHT:
+        return await update.message.reply_text("Usage: /gset_weight <user_id> <weight>")
+    user_id, weight = int(args[0]), int(args[1])
+    s = _load(_giveaway_for(update))
+    if s["draws"]:
+        # The audit log replays earlier draws against the current weights.
+        return await update.message.reply_text("Weights are locked once winners have been drawn.")
+    async with ENTRIES_LOCK:
+        with _transaction(s):
+            entered = user_id in s["entries"]
+            if entered:
+                _commit(s, {"op": "weight", "user_id": user_id, "weight": weight})
+    if not entered:
+        return await update.message.reply_text("That user has not entered the giveaway.")
+    await update.message.reply_text(f"Weight for {user_id} set to {weight}.")
+
+@callback_route("admin:clear_winners", admin=True, debounce=True)
+async def _cb_clear_winners(update, context, s, arg):
+    async with WINNERS_LOCK:
+        with _transaction(s):
+            _commit(s, {"op": "clear_winners"})
+    log.info("Winners list cleared.")
+    await update.callback_query.edit_message_text("Winners list cleared.", reply_markup=admin_keyboard(s))
+
+@callback_route("admin:set_announce_interval", admin=True)
+async def _cb_set_announce_interval(update, context, s, arg):
+    log.debug("Set Announcement Interval button pressed.")
+    # Show instructions to admin in private chat
+    if update.effective_chat.type == "private":
+        await update.callback_query.edit_message_text(
+            "To set the announcement interval, use:\n/gset_announce_settings <minutes> <message>\nExample: /gset_announce_settings 15 Giveaway is live! DM the bot to enter.",
+            reply_markup=admin_keyboard(s)
+        )
+    else:
+        await update.callback_query.edit_message_text("Please DM the bot to set the announcement interval.", reply_markup=admin_keyboard(s))
 
-async def show_winners(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@callback_route("admin:reset_announce", admin=True)
+async def _cb_reset_announce(update, context, s, arg):
+    await update.callback_query.edit_message_text("Are you sure you want to reset announcement settings?", reply_markup=_CONFIRM_RESET_KB)
+
+@callback_route("admin:confirm_reset_announce", admin=True, debounce=True)
+async def _cb_confirm_reset_announce(update, context, s, arg):
+    _reset_announce_settings(_load_admin_groups().get(str(update.callback_query.from_user.id)))
+    log.info("Announcement settings reset to default.")
+    await update.callback_query.edit_message_text("Announcement settings reset to default.", reply_markup=admin_keyboard(s))
+
+# Telegram rejects messages over 4096 characters; a page of 25 stays under it
+# even with the longest usernames.
+ENTRIES_PAGE_SIZE = int(os.getenv("ENTRIES_PAGE_SIZE", "25"))
+EXPORT_FIELDS = ["number", "user_id", "username", "first_name", "last_name"]
+
+def _entry_label(e: Dict[str, Any]) -> str:
+    return f"@{e.get('username','')}" if e.get("username") else f"{e.get('first_name','')} {e.get('last_name','')}".strip()
+
+def _list_page_view(kind: str, s: Dict[str, Any], page: int) -> Tuple[str, InlineKeyboardMarkup]:
+    # Renders one page of entries or winners; only that page's rows are touched.
+    if kind == "entries":
+        store = s["entries"]
+        pages = max(1, store.page_count(ENTRIES_PAGE_SIZE))
+        page = min(max(page, 0), pages - 1)
+        lines = [f"#{e['number']} - {_entry_label(e)} (id {e.get('user_id','?')})" for e in store.page(page, ENTRIES_PAGE_SIZE)]
+        title = f"Entries ({len(store)})"
+    else:
+        winners = s["winners"]
+        pages = max(1, -(-len(winners) // ENTRIES_PAGE_SIZE))
+        page = min(max(page, 0), pages - 1)
+        start = page * ENTRIES_PAGE_SIZE
+        lines = [f"{i}. {_entry_label(e)} (id {e.get('user_id','?')})" for i, e in enumerate(winners[start:start + ENTRIES_PAGE_SIZE], start=start + 1)]
+        title = f"Winners ({len(winners)})"
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀ Prev", callback_data=f"admin:{kind}_page:{page - 1}"))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton("Next ▶", callback_data=f"admin:{kind}_page:{page + 1}"))
+    kb = [nav] if nav else []
+    kb.append([
+        InlineKeyboardButton("Export CSV 📄", callback_data=f"admin:export_{kind}:csv"),
+        InlineKeyboardButton("Export JSONL 📄", callback_data=f"admin:export_{kind}:jsonl")
+    ])
+    kb.append([InlineKeyboardButton("Back", callback_data="user:admin")])
+    text = f"{title} — page {page + 1}/{pages}:\n" + ("\n".join(lines) if lines else "(none)")
+    return text[:4096], InlineKeyboardMarkup(kb)
+
+async def _show_list(kind: str, update: Update, context: ContextTypes.DEFAULT_TYPE, page: int = 0):
     query = getattr(update, "callback_query", None)
     try:
-        print("[DEBUG] show_winners: is_admin check")
         if not await is_admin(update.effective_user.id, update, context):
-            print("[DEBUG] show_winners: not admin")
+            log.debug("show_%s: not admin", kind)
             if query:
                 return await query.edit_message_text("Unauthorized.")
             return await update.message.reply_text("Unauthorized.")
-        s = _load()
-        print(f"[DEBUG] show_winners: loaded state: {s}")
-        winners = s.get("winners", None)
-        print(f"[DEBUG] show_winners: winners: {winners}")
-        if not isinstance(winners, list):
-            print(f"[ERROR] show_winners: winners is not a list: {winners}")
+        s = _load(_giveaway_for(update))
+        if not s[kind]:
             if query:
-                return await query.edit_message_text("Winners data error.")
-            return await update.message.reply_text("Winners data error.")
-        if not winners:
-            print("[DEBUG] show_winners: no winners")
-            if query:
-                return await query.edit_message_text("Winners: (none)")
-            return await update.message.reply_text("Winners: (none)")
-        print("[DEBUG] show_winners: formatting winners")
-        lines = []
-        for i, e in enumerate(winners, start=1):
-            tag = f"@{e.get('username','')}" if e.get("username") else f"{e.get('first_name','')} {e.get('last_name','')}".strip()
-            lines.append(f"{i}. {tag} (id {e.get('user_id','?')})")
-        print(f"[DEBUG] show_winners: lines: {lines}")
+                return await query.edit_message_text(f"{kind.capitalize()}: (none)")
+            return await update.message.reply_text(f"{kind.capitalize()}: (none)")
+        text, kb = _list_page_view(kind, s, page)
         if query:
-            await query.edit_message_text("Winners:\n" + "\n".join(lines))
+            await query.edit_message_text(text, reply_markup=kb)
         else:
-            await update.message.reply_text("Winners:\n" + "\n".join(lines))
+            await update.message.reply_text(text, reply_markup=kb)
     except Exception as e:
-        print(f"[ERROR] show_winners failed: {e}")
+        log.error("show_%s failed: %s", kind, e)
         if query:
-            await query.edit_message_text("Error displaying winners.")
+            await query.edit_message_text(f"Error displaying {kind}.")
         else:
-            await update.message.reply_text("Error displaying winners.")
+            await update.message.reply_text(f"Error displaying {kind}.")
+
+async def show_entries(update: Update, context: ContextTypes.DEFAULT_TYPE, page: int = 0):
+    await _show_list("entries", update, context, page)
+
+async def show_winners(update: Update, context: ContextTypes.DEFAULT_TYPE, page: int = 0):
+    await _show_list("winners", update, context, page)
+
+def _write_export(rows, fmt: str):
+    # Writes rows to a temporary file one at a time, so the document is never
+    # held in memory as a whole.
+    import csv
+    f = tempfile.TemporaryFile()
+    out = io.TextIOWrapper(f, encoding="utf-8", newline="")
+    if fmt == "jsonl":
+        for e in rows:
+            out.write(json.dumps({k: e.get(k, "") for k in EXPORT_FIELDS}, ensure_ascii=False) + "\n")
+    else:
+        writer = csv.writer(out)
+        writer.writerow(EXPORT_FIELDS)
+        for e in rows:
+            writer.writerow([e.get(k, "") for k in EXPORT_FIELDS])
+    out.flush()
+    out.detach()
+    f.seek(0)
+    return f
+
+async def export_list(kind: str, fmt: str, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    s = _load(_giveaway_for(update))
+    # Copy the columns or row references so concurrent entries can't change
+    # them while the export thread walks them.
+    rows = s["entries"].copy() if kind == "entries" else list(s["winners"])
+    f = await asyncio.to_thread(_write_export, rows, fmt)
+    try:
+        await context.bot.send_document(chat_id=update.effective_chat.id, document=f, filename=f"{kind}.{fmt}")
+    finally:
+        f.close()
+
+ADMIN_TEXT_COMMANDS = {"/gshow_entries", "/gshow_winners", "/gexport_entries", "/gexport_winners"}
+
+class AdminTextFilter(filters.MessageFilter):
+    # Lets through only the text admin_panel_shortcuts can act on: private
+    # messages from someone midway through adding or editing a button, or one
+    # of ADMIN_TEXT_COMMANDS. Decided from memory before any handler runs, so
+    # group chatter never reaches is_admin and costs no API call.
+    def __init__(self, user_data):
+        super().__init__(name="AdminTextFilter")
+        self._user_data = user_data
+
+    def filter(self, message) -> bool:
+        if message.chat.type != ChatType.PRIVATE or message.from_user is None:
+            return False
+        data = self._user_data.get(message.from_user.id)
+        if data and (data.get("add_button_step") or data.get("edit_button_step")):
+            return True
+        words = (message.text or "").split(maxsplit=1)
+        return bool(words) and words[0].lower() in ADMIN_TEXT_COMMANDS
 
 async def admin_panel_shortcuts(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # Optional text commands for admins
+    # Optional text commands for admins; only reached through AdminTextFilter.
     if not await is_admin(update.effective_user.id, update, context):
         return await update.message.reply_text("Unauthorized.")
 
     # Add New Button flow
     step = context.user_data.get("add_button_step")
     if step:
-        print(f"[DEBUG] Add Button Flow Step: {step}")
+        log.debug("Add Button Flow Step: %s", step)
         text = update.message.text.strip()
         if step == "name":
-            print(f"[DEBUG] Received button name: {text}")
+            log.debug("Received button name: %s", text)
             context.user_data["new_button_name"] = text
             context.user_data["add_button_step"] = "url"
             return await update.message.reply_text("Send the URL for the new button:")
         elif step == "url":
-            print(f"[DEBUG] Received button URL: {text}")
+            log.debug("Received button URL: %s", text)
             context.user_data["new_button_url"] = text
             context.user_data["add_button_step"] = "side_by_side"
             kb = [[
@@ -789,61 +2835,47 @@ async def admin_panel_shortcuts(update: Update, context: ContextTypes.DEFAULT_TY
                 InlineKeyboardButton("Regular", callback_data="admin:add_regular")
             ]]
             return await update.message.reply_text("Should this button be side by side with the next one or regular?", reply_markup=InlineKeyboardMarkup(kb))
-        print(f"[DEBUG] Waiting for side_by_side selection via callback.")
+        log.debug("Waiting for side_by_side selection via callback.")
         return
     # Edit Button flow
     edit_step = context.user_data.get("edit_button_step")
     if edit_step:
-        print(f"[DEBUG] Edit Button Flow Step: {edit_step}")
+        log.debug("Edit Button Flow Step: %s", edit_step)
         text = update.message.text.strip()
         idx = context.user_data.get("edit_button_idx")
         if edit_step == "name":
-            print(f"[DEBUG] Received new button name: {text}")
+            log.debug("Received new button name: %s", text)
             context.user_data["edit_button_name"] = text
             # Save change immediately
-            custom_buttons = _load_custom_buttons()
-            if idx is not None and 0 <= idx < len(custom_buttons):
-                btn = custom_buttons[idx]
-                btn["name"] = text
-                _save_custom_buttons(custom_buttons)
+            async with BUTTONS_LOCK:
+                custom_buttons = _load_custom_buttons()
+                if idx is not None and 0 <= idx < len(custom_buttons):
+                    btn = custom_buttons[idx]
+                    btn["name"] = text
+                    _save_custom_buttons(custom_buttons)
             context.user_data["edit_button_step"] = None
             # Return to edit menu
-            btn = custom_buttons[idx] if idx is not None and 0 <= idx < len(custom_buttons) else None
-            edit_kb = [
-                [InlineKeyboardButton("Edit Name", callback_data="admin:edit_name")],
-                [InlineKeyboardButton("Edit URL", callback_data="admin:edit_url")],
-                [InlineKeyboardButton("Edit Side-by-Side", callback_data="admin:edit_side_by_side_menu")],
-                [InlineKeyboardButton("Back", callback_data="admin:manage_buttons")]
-            ]
-            await update.message.reply_text(
-                f"Editing Button #{idx+1}:\nCurrent name: {btn['name']}\nCurrent URL: {btn['url']}\nCurrent side-by-side: {'Yes' if btn.get('side_by_side') else 'No'}",
-                reply_markup=InlineKeyboardMarkup(edit_kb)
-            )
-            return
+            if idx is None or not 0 <= idx < len(custom_buttons):
+                return await update.message.reply_text("Invalid button index.")
+            text, kb = edit_button_view(idx, custom_buttons[idx])
+            return await update.message.reply_text(text, reply_markup=kb)
         elif edit_step == "url":
-            print(f"[DEBUG] Received new button URL: {text}")
+            log.debug("Received new button URL: %s", text)
             context.user_data["edit_button_url"] = text
             # Save change immediately
-            custom_buttons = _load_custom_buttons()
-            if idx is not None and 0 <= idx < len(custom_buttons):
-                btn = custom_buttons[idx]
-                btn["url"] = text
-                _save_custom_buttons(custom_buttons)
+            async with BUTTONS_LOCK:
+                custom_buttons = _load_custom_buttons()
+                if idx is not None and 0 <= idx < len(custom_buttons):
+                    btn = custom_buttons[idx]
+                    btn["url"] = text
+                    _save_custom_buttons(custom_buttons)
             context.user_data["edit_button_step"] = None
             # Return to edit menu
-            btn = custom_buttons[idx] if idx is not None and 0 <= idx < len(custom_buttons) else None
-            edit_kb = [
-                [InlineKeyboardButton("Edit Name", callback_data="admin:edit_name")],
-                [InlineKeyboardButton("Edit URL", callback_data="admin:edit_url")],
-                [InlineKeyboardButton("Edit Side-by-Side", callback_data="admin:edit_side_by_side_menu")],
-                [InlineKeyboardButton("Back", callback_data="admin:manage_buttons")]
-            ]
-            await update.message.reply_text(
-                f"Editing Button #{idx+1}:\nCurrent name: {btn['name']}\nCurrent URL: {btn['url']}\nCurrent side-by-side: {'Yes' if btn.get('side_by_side') else 'No'}",
-                reply_markup=InlineKeyboardMarkup(edit_kb)
-            )
-            return
-        print(f"[DEBUG] Waiting for edit selection via callback.")
+            if idx is None or not 0 <= idx < len(custom_buttons):
+                return await update.message.reply_text("Invalid button index.")
+            text, kb = edit_button_view(idx, custom_buttons[idx])
+            return await update.message.reply_text(text, reply_markup=kb)
+        log.debug("Waiting for edit selection via callback.")
         return
 
     cmd = (update.message.text or "").strip().lower()
@@ -851,78 +2883,153 @@ async def admin_panel_shortcuts(update: Update, context: ContextTypes.DEFAULT_TY
         return await show_entries(update, context)
     if cmd == "/gshow_winners":
         return await show_winners(update, context)
+    if cmd.split()[:1] in (["/gexport_entries"], ["/gexport_winners"]):
+        fmt = "jsonl" if cmd.split()[1:2] == ["jsonl"] else "csv"
+        return await export_list(cmd.split()[0][len("/gexport_"):], fmt, update, context)
 
-def main():
-    app = Application.builder().token(TOKEN).build()
-    app.add_handler(CommandHandler("gset_announce_settings", set_announce_settings))
-    app.add_handler(CommandHandler("gshow_announce_settings", show_announce_settings))
+# RUN_MODE=webhook serves updates on WEBHOOK_LISTEN:WEBHOOK_PORT instead of
+# long polling; Telegram posts to WEBHOOK_URL, which has to reach that port
+# (usually through a TLS-terminating proxy). Up to UPDATE_CONCURRENCY updates
+# are handled at once. Once WEBHOOK_QUEUE_SIZE are waiting, requests block
+# until there is room, so Telegram backs off instead of the queue growing.
+RUN_MODE = os.getenv("RUN_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH") or urlsplit(WEBHOOK_URL).path or "/"
+# Workers behind one URL must share the secret, so shared state needs it set;
+# a single worker makes one up. Only workers with WEBHOOK_REGISTER (default
+# on; leave it on one worker) call setWebhook.
+WEBHOOK_SECRET_SET = bool(os.getenv("WEBHOOK_SECRET"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_REGISTER = os.getenv("WEBHOOK_REGISTER", "1") != "0"
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+# Base URL of the Bot API, for a self-hosted Bot API server.
+BOT_API_URL = os.getenv("BOT_API_URL", "")
+# Prometheus metrics, served next to the webhook. In polling mode use /gstats.
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+
+async def run_webhook(app: Application) -> None:
+    import signal
+    from aiohttp import web
+    secret = WEBHOOK_SECRET.encode()
+
+    async def receive(request):
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "").encode("utf-8", "replace")
+        if not hmac.compare_digest(token, secret):
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(), app.bot)
+        except Exception as e:
+            log.warning("Bad webhook payload: %s", e)
+            return web.Response(status=400)
+        await app.update_queue.put(update)
+        return web.Response()
+
+    async def metrics(request):
+        return web.Response(text=METRICS.render(), content_type="text/plain", headers={"X-Content-Type-Options": "nosniff"})
+
+    webapp = web.Application()
+    webapp.router.add_post(WEBHOOK_PATH, receive)
+    webapp.router.add_get(METRICS_PATH, metrics)
+    runner = web.AppRunner(webapp, access_log=None)
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    try:
+        await runner.setup()
+        await web.TCPSite(runner, WEBHOOK_LISTEN, WEBHOOK_PORT).start()
+        if WEBHOOK_REGISTER:
+            await app.bot.set_webhook(
+                WEBHOOK_URL, allowed_updates=Update.ALL_TYPES,
+                secret_token=WEBHOOK_SECRET, max_connections=WEBHOOK_MAX_CONNECTIONS
+            )
+        log.info("Serving webhook on %s:%s%s", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+def build_application(request=None) -> Application:
+    # The bot with all its handlers, talking to Telegram through `request`
+    # (benchmarks pass an in-process fake Bot API).
+    builder = Application.builder().token(TOKEN).post_init(_post_init).post_stop(_post_stop).post_shutdown(_flush_on_shutdown)
+    builder.request(request or MetricsRequest(connection_pool_size=256))
+    if BOT_API_URL:
+        builder.base_url(BOT_API_URL)
+    if RUN_MODE == "webhook":
+        builder.updater(None).concurrent_updates(UPDATE_CONCURRENCY).update_queue(asyncio.Queue(WEBHOOK_QUEUE_SIZE))
+    app = builder.build()
+    app.add_handler(CommandHandler("gset_announce_settings", _instrumented(set_announce_settings)))
+    app.add_handler(CommandHandler("gshow_announce_settings", _instrumented(show_announce_settings)))
     async def group_giveaway_entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat = update.effective_chat
         user = update.effective_user
         if chat and chat.type in ["group", "supergroup"]:
             # Add to admin list if user is admin
             if await is_admin(user.id, update, context):
-                groups = _load_admin_groups()
-                already_admin = str(user.id) in groups and groups[str(user.id)] == chat.id
-                if not already_admin:
-                    _save_admin_group(user.id, chat.id)
-            bot_username = (await context.bot.get_me()).username
+                async with ADMIN_GROUPS_LOCK:
+                    groups = _load_admin_groups()
+                    already_admin = str(user.id) in groups and groups[str(user.id)] == chat.id
+                    if not already_admin:
+                        _save_admin_group(user.id, chat.id)
             await update.message.reply_text(
                 "To enter the giveaway, DM this bot and use /start.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("DM the Bot", url=f"https://t.me/{bot_username}")]
-                ])
+                reply_markup=await dm_bot_markup(context.bot, chat.id)
             )
         else:
             await start(update, context)
-    app.add_handler(CommandHandler("gstart", group_giveaway_entry))
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("giveaway", group_giveaway_entry))
-    app.add_handler(CommandHandler("gset_announce_interval", set_announce_interval))
+    app.add_handler(CommandHandler("gstart", _instrumented(group_giveaway_entry)))
+    app.add_handler(CommandHandler("start", _instrumented(start)))
+    app.add_handler(CommandHandler("giveaway", _instrumented(group_giveaway_entry)))
+    app.add_handler(CommandHandler("gset_announce_interval", _instrumented(set_announce_interval)))
+    app.add_handler(CommandHandler("gdraw", _instrumented(draw_command)))
+    app.add_handler(CommandHandler("gset_weight", _instrumented(set_entry_weight)))
+    app.add_handler(CommandHandler("gstats", _instrumented(stats_command)))
     app.add_handler(CallbackQueryHandler(handle_button))
-    # Always process admin_panel_shortcuts if add_button_step is set, or if user is in ADMIN_IDS
-    def admin_message_filter(message):
-        # Always allow if add_button_step is set
-        user_data = app.context.user_data.get(message.from_user.id, {}) if hasattr(app.context, 'user_data') else {}
-        if user_data.get('add_button_step'):
-            return True
-        # Otherwise, check admin
-        return message.from_user.id in ADMIN_IDS
+    app.add_handler(ChatMemberHandler(_instrumented(track_chat_member), ChatMemberHandler.ANY_CHAT_MEMBER))
+    app.add_handler(MessageHandler(filters.TEXT & AdminTextFilter(app.user_data), _instrumented(admin_panel_shortcuts)))
+    _startup_phase("build")
+    return app
 
-    app.add_handler(MessageHandler(filters.TEXT, admin_panel_shortcuts))
+_startup_phase("imports")
 
-    # Regular announcements
-    async def announce_giveaway_periodically(app):
-        while True:
-            settings = _load_announce_settings()
-            interval = settings.get("interval", 10)
-            message = settings.get("message", "A giveaway is active! DM this bot and use /start to enter.")
-            await asyncio.sleep(interval * 60)
-            s = _load()
-            if s["active"]:
-                groups = _load_admin_groups()
-                for group_id in set(groups.values()):
-                    bot_username = (await app.bot.get_me()).username
-                    await app.bot.send_message(
-                        chat_id=group_id,
-                        text=message,
-                        reply_markup=InlineKeyboardMarkup([
-                            [InlineKeyboardButton("DM the Bot", url=f"https://t.me/{bot_username}")]
-                        ])
-                    )
-
-    async def run_announcer():
-        await announce_giveaway_periodically(app)
-
-    try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    loop.create_task(run_announcer())
-    app.run_polling(close_loop=False)
+def main():
+    app = build_application()
+    if RUN_MODE == "webhook":
+        asyncio.run(run_webhook(app))
+    else:
+        app.run_polling(close_loop=False, allowed_updates=Update.ALL_TYPES)
 
 if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s", level=LOG_LEVEL)
+    # httpx logs every request at INFO.
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    if sys.argv[1:2] == ["migrate-sqlite"]:
+        migrate_json_to_sqlite(sys.argv[2] if len(sys.argv) > 2 else SQLITE_FILE)
+        raise SystemExit(0)
+    if sys.argv[1:2] == ["verify-draws"]:
+        path = sys.argv[2] if len(sys.argv) > 2 else DRAW_AUDIT_FILE
+        raise SystemExit(0 if verify_draws_cli(path, int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_GIVEAWAY) else 1)
     if TOKEN == "PUT_YOUR_TOKEN_HERE" or not TOKEN:
         raise SystemExit("Set TELEGRAM_BOT_TOKEN env var or hardcode TOKEN.")
+    if RUN_MODE == "webhook" and not WEBHOOK_URL:
+        raise SystemExit("Set WEBHOOK_URL for RUN_MODE=webhook.")
+    if RUN_MODE == "webhook" and SHARED_STATE and not WEBHOOK_SECRET_SET:
+        raise SystemExit("Set WEBHOOK_SECRET for RUN_MODE=webhook with STORAGE_BACKEND=shared, the same on every worker.")
     main()